@@ -0,0 +1,20 @@
+import pandas as pd
+
+# 全角の数字・記号を半角に変換する表（数値の解析用）
+ASCII_DIGITS = str.maketrans('０１２３４５６７８９．，', '0123456789.,')
+# アクセスの列数（chintai.dbと同じく3件まで）
+ACCESS_COUNT = 3
+# 「線路名 駅名 徒歩N分」（homes）と「線路名/駅名 歩N分」（スーモ）の両方に合う形式
+ACCESS_PATTERN = r'^\s*(?P<線路名>[^/\s]+)[/\s]+(?P<駅名>[^/\s]+?)駅?\s+徒?歩\s*(?P<徒歩>\d+)\s*分'
+
+# アクセスを「アクセスN線路名」「アクセスN駅名」「アクセスN徒歩(分)」の列に分ける
+def split_access(values):
+    parts = values.fillna('').str.split(', ', n=ACCESS_COUNT, expand=True)
+    result = pd.DataFrame(index=values.index)
+    for i in range(ACCESS_COUNT):
+        part = parts[i] if i in parts.columns else pd.Series(None, index=values.index, dtype=object)
+        access = part.fillna('').str.translate(ASCII_DIGITS).str.extract(ACCESS_PATTERN)
+        result[f'アクセス{i + 1}徒歩(分)'] = pd.to_numeric(access['徒歩'], errors='coerce')
+        result[f'アクセス{i + 1}線路名'] = access['線路名']
+        result[f'アクセス{i + 1}駅名'] = access['駅名'] + '駅'
+    return result
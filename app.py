@@ -2,12 +2,23 @@ import os
 import streamlit as st
 import pandas as pd
 import numpy as np
-import sqlite3
 from dotenv import load_dotenv
 from geopy.geocoders import Nominatim
 import folium
-from streamlit_folium import folium_static
+from branca.colormap import LinearColormap
+from folium.plugins import FastMarkerCluster, HeatMap
+from streamlit_folium import st_folium
 import hashlib
+from instrumentation import METRICS_SAMPLE_RATE, count, finish_trace, span, start_trace, timed
+from property_store import (
+    get_filter_options, get_station_locations, query_properties, get_market_stats, compare_to_ward_median
+)
+from user_repository import (
+    init_repository, add_user, login_user, save_favorite_property,
+    remove_favorite_properties, get_favorite_property_details
+)
+
+load_dotenv()
 
 # セッション状態の初期化
 if 'show_all' not in st.session_state:
@@ -25,60 +36,234 @@ if 'search_clicked' not in st.session_state:
 def toggle_show_all():
     st.session_state['show_all'] = not st.session_state['show_all']
 
-# SQLiteデータベースからデータを読み込む関数
-def load_data_from_sqlite(db_path, table_name):
-    conn = sqlite3.connect(db_path)
-    query = f"SELECT * FROM {table_name}"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
-
-def preprocess_dataframe(df):
-    df['家賃'] = pd.to_numeric(df['家賃'], errors='coerce')
-    df = df.dropna(subset=['家賃'])
-    return df
-
 def make_clickable(url, name):
     return f'<a target="_blank" href="{url}">{name}</a>'
 
+# 地図の表示設定（.envまたは環境変数で変更可能）
+# この件数を超えるとマーカーではなくヒートマップで表示する
+MAP_HEATMAP_THRESHOLD = int(os.getenv('MAP_HEATMAP_THRESHOLD', '5000'))
+# 検索結果が0件の時の地図の中心（東京駅）
+DEFAULT_MAP_CENTER = [35.681236, 139.767125]
+
+# マーカーを生成するJavaScript（ポップアップは開いた時に初めて生成する）
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindPopup(function () { return row[2]; }, {maxWidth: 400});
+    return marker;
+}
+"""
+
+# ポップアップのHTMLを列単位でまとめて作成する関数
+def build_popup_html(df):
+    return (
+        '<b>名称:</b> ' + df['名称'].astype(str) + '<br>'
+        + '<b>アドレス:</b> ' + df['アドレス'].astype(str) + '<br>'
+        + '<b>家賃:</b> ' + df['家賃'].astype(str) + '万円<br>'
+        + '<b>間取り:</b> ' + df['間取り'].astype(str) + '<br>'
+        + '<a href="' + df['物件詳細URL'].astype(str) + '" target="_blank">物件詳細</a>'
+    )
+
 # 地図を作成し、マーカーを追加する関数
-def create_map(filtered_df):
-    map_center = [filtered_df['緯度'].mean(), filtered_df['経度'].mean()]
+# mode: 'auto'（件数に応じて切り替え）、'cluster'（マーカークラスタ）、'heatmap'（ヒートマップ）
+@timed('create_map')
+def create_map(filtered_df, mode='auto', heatmap_threshold=None):
+    if heatmap_threshold is None:
+        heatmap_threshold = MAP_HEATMAP_THRESHOLD
+    points = filtered_df.dropna(subset=['緯度', '経度'])
+    count('map_points', len(points))
+    if points.empty:
+        return folium.Map(location=DEFAULT_MAP_CENTER, zoom_start=12)
+    latitudes = points['緯度'].astype(float)
+    longitudes = points['経度'].astype(float)
+    map_center = [latitudes.mean(), longitudes.mean()]
     m = folium.Map(location=map_center, zoom_start=12)
-    for idx, row in filtered_df.iterrows():
-        if pd.notnull(row['緯度']) and pd.notnull(row['経度']):
-            popup_html = f"""
-            <b>名称:</b> {row['名称']}<br>
-            <b>アドレス:</b> {row['アドレス']}<br>
-            <b>家賃:</b> {row['家賃']}万円<br>
-            <b>間取り:</b> {row['間取り']}<br>
-            <a href="{row['物件詳細URL']}" target="_blank">物件詳細</a>
-            """
-            popup = folium.Popup(popup_html, max_width=400)
-            folium.Marker(
-                [row['緯度'], row['経度']],
-                popup=popup
-            ).add_to(m)
+    if mode == 'heatmap' or (mode == 'auto' and len(points) > heatmap_threshold):
+        with span('heatmap'):
+            HeatMap(list(zip(latitudes.tolist(), longitudes.tolist())), name='物件の分布').add_to(m)
+    else:
+        with span('marker_cluster'):
+            data = list(zip(latitudes.tolist(), longitudes.tolist(), build_popup_html(points).tolist()))
+            FastMarkerCluster(data, callback=MARKER_CALLBACK, name='物件').add_to(m)
     return m
 
-# 検索結果を表示する関数
-def display_search_results(filtered_df):
-    for idx, row in filtered_df.iterrows():
+# 区の境界のGeoJSON（国土数値情報の行政区域など）。指定がなければ区の中心に円を描く
+WARD_GEOJSON_PATH = os.getenv('WARD_GEOJSON_PATH')
+# GeoJSONで区名が入っているプロパティ
+WARD_GEOJSON_KEY = os.getenv('WARD_GEOJSON_KEY', 'N03_004')
+
+# 区ごとの家賃の中央値を色分けした地図を作成する関数（相場表の区単位の行だけを使う）
+def create_ward_map(ward_stats):
+    ward_stats = ward_stats.dropna(subset=['家賃_中央値'])
+    located = ward_stats.dropna(subset=['緯度', '経度'])
+    center = [located['緯度'].mean(), located['経度'].mean()] if not located.empty else DEFAULT_MAP_CENTER
+    m = folium.Map(location=center, zoom_start=11)
+    if ward_stats.empty:
+        return m
+    if WARD_GEOJSON_PATH:
+        folium.Choropleth(
+            geo_data=WARD_GEOJSON_PATH,
+            data=ward_stats,
+            columns=['区', '家賃_中央値'],
+            key_on=f'feature.properties.{WARD_GEOJSON_KEY}',
+            fill_color='YlOrRd',
+            legend_name='家賃の中央値（万円）',
+        ).add_to(m)
+        return m
+    colormap = LinearColormap(['#ffffb2', '#fd8d3c', '#bd0026'], vmin=ward_stats['家賃_中央値'].min(), vmax=ward_stats['家賃_中央値'].max())
+    colormap.caption = '家賃の中央値（万円）'
+    for row in located.itertuples(index=False):
+        folium.CircleMarker(
+            location=[row.緯度, row.経度],
+            radius=20,
+            color=colormap(row.家賃_中央値),
+            fill=True,
+            fill_opacity=0.7,
+            tooltip=f"{row.区}: 中央値 {row.家賃_中央値:.1f}万円（{row.件数}件）",
+        ).add_to(m)
+    colormap.add_to(m)
+    return m
+
+# 区ごとの家賃相場（表と地図）を表示する関数
+def display_market_stats(market_stats):
+    ward_stats = market_stats[market_stats['集計単位'] == '区']
+    with st.expander('■ 区ごとの家賃相場'):
+        st.dataframe(
+            ward_stats[['区', '件数', '家賃_p25', '家賃_中央値', '家賃_p75', '平米単価_中央値']],
+            column_config={
+                '家賃_p25': st.column_config.NumberColumn('家賃（下位25%）', format='%.1f万円'),
+                '家賃_中央値': st.column_config.NumberColumn('家賃（中央値）', format='%.1f万円'),
+                '家賃_p75': st.column_config.NumberColumn('家賃（上位25%）', format='%.1f万円'),
+                '平米単価_中央値': st.column_config.NumberColumn('平米単価（中央値）', format='%.0f円/m²'),
+            },
+            hide_index=True,
+            use_container_width=True,
+        )
+        st_folium(create_ward_map(ward_stats), width=700, returned_objects=[], key='ward_map')
+
+# 場所で絞り込む方法の選択肢
+LOCATION_FILTERS = ['指定なし', '駅から徒歩', '駅からの距離', '地図の表示範囲']
+
+# 地図の表示範囲（st_foliumが返すbounds）を（南, 西, 北, 東）に変換する関数
+def bounds_to_bbox(bounds):
+    if not bounds or not bounds.get('_southWest') or not bounds.get('_northEast'):
+        return None
+    south_west, north_east = bounds['_southWest'], bounds['_northEast']
+    bbox = (south_west['lat'], south_west['lng'], north_east['lat'], north_east['lng'])
+    return None if None in bbox else bbox
+
+# 場所の絞り込み条件を選ぶ部品を表示し、query_propertiesに渡す条件を返す関数
+def location_filter_inputs(db_path, table_name, stations):
+    mode = st.radio('■ 場所で絞り込む', LOCATION_FILTERS, horizontal=True, key='location_filter')
+    if mode == '駅から徒歩':
         col1, col2 = st.columns([2, 1])
-        with col1:
-            st.write(f"### 物件番号: {idx+1}")
-            st.write(f"**名称:** {row['名称']}")
-            st.write(f"**アドレス:** {row['アドレス']}")
-            st.write(f"**階数:** {row['階数']}")
-            st.write(f"**家賃:** {row['家賃']}万円")
-            st.write(f"**間取り:** {row['間取り']}")
-            st.write(f"**物件詳細URL:** {make_clickable(row['物件詳細URL'], '詳細情報はこちらをクリック')}", unsafe_allow_html=True)
-            if st.button(f"お気に入り登録", key=f"favorite_{idx}"):
-                save_favorite_property(st.session_state['username'], idx)
-                st.success(f"{row['名称']}をお気に入りに追加しました")
-        with col2:
-            st.image(row['物件画像URL'], use_column_width=True)
-        st.write("---")
+        station = col1.selectbox('駅', stations, key='walk_station')
+        walk_max = col2.slider('徒歩（分以内）', 1, 30, 10, key='walk_max')
+        return {'station': station, 'walk_max': walk_max}
+    if mode == '駅からの距離':
+        locations = get_station_locations(db_path, table_name)
+        col1, col2 = st.columns([2, 1])
+        station = col1.selectbox('駅', [name for name in stations if name in locations], key='near_station')
+        radius = col2.slider('距離（m以内）', 100, 3000, 800, step=100, key='near_radius')
+        return {'near': (*locations[station], radius)} if station else {}
+    if mode == '地図の表示範囲':
+        bbox = bounds_to_bbox(st.session_state.get('map_bounds'))
+        if bbox is None:
+            st.info("地図を表示してから「検索＆更新」を押すと、表示範囲の物件に絞り込みます")
+            return {}
+        return {'bbox': bbox}
+    return {}
+
+# 検索結果の1ページあたりの件数の選択肢
+PAGE_SIZE_OPTIONS = [10, 20, 50, 100]
+# 並べ替えの選択肢（表示名 -> 列名）
+SORT_KEYS = {'家賃': '家賃', '面積': '面積', '徒歩分': 'アクセス1徒歩(分)'}
+# 検索結果の表に表示する列
+RESULT_COLUMNS = ['物件画像URL', '名称', 'アドレス', '階数', '家賃', '区の中央値比', '間取り', '面積', 'アクセス1徒歩(分)', '物件詳細URL']
+
+# 並べ替えたうえで指定ページの行だけを取り出す関数（pageは1始まり）
+def paginate(df, sort_column, ascending, page, page_size):
+    order = df[sort_column].sort_values(ascending=ascending, kind='stable', na_position='last').index
+    start = (page - 1) * page_size
+    return df.loc[order[start:start + page_size]]
+
+# 検索結果を表示する関数
+# 1ページ分だけを表にして表示し、画像は表のセルが表示された時に読み込まれる
+# market_statsを渡すと、表示中の物件の家賃を区の中央値と比べる
+@timed('display_search_results')
+def display_search_results(filtered_df, market_stats=None):
+    if filtered_df.empty:
+        st.info("条件に合う物件がありません")
+        return
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        sort_label = st.selectbox('並べ替え', list(SORT_KEYS), key='result_sort')
+    with col2:
+        ascending = st.radio('順序', ('昇順', '降順'), horizontal=True, key='result_order') == '昇順'
+    with col3:
+        page_size = st.selectbox('表示件数', PAGE_SIZE_OPTIONS, key='result_page_size')
+    page_count = (len(filtered_df) - 1) // page_size + 1
+    with col4:
+        page = st.number_input('ページ', min_value=1, max_value=page_count, value=1, step=1, key='result_page')
+    st.write(f"{len(filtered_df)}件中 {(page - 1) * page_size + 1}〜{min(page * page_size, len(filtered_df))}件目（{page}/{page_count}ページ）")
+
+    with span('paginate'):
+        page_df = paginate(filtered_df, SORT_KEYS[sort_label], ascending, page, page_size)
+        if market_stats is not None:
+            page_df = page_df.assign(区の中央値比=compare_to_ward_median(page_df, market_stats))
+    count('rows_rendered', len(page_df))
+    st.dataframe(
+        page_df[[col for col in RESULT_COLUMNS if col in page_df.columns]],
+        column_config={
+            '物件画像URL': st.column_config.ImageColumn('画像'),
+            '家賃': st.column_config.NumberColumn('家賃', format='%.1f万円'),
+            '区の中央値比': st.column_config.NumberColumn('区の中央値比', format='%+.1f%%', help='マイナスは区の中央値より安い'),
+            '物件詳細URL': st.column_config.LinkColumn('物件詳細', display_text='詳細情報'),
+        },
+        hide_index=True,
+        use_container_width=True,
+    )
+
+    # お気に入り登録は表示中のページから選ぶ
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        idx = st.selectbox(
+            'お気に入りに追加する物件',
+            page_df.index.tolist(),
+            format_func=lambda i: f"{page_df.at[i, '名称']}（{page_df.at[i, '間取り']} / {page_df.at[i, '家賃']}万円）",
+            key='favorite_select'
+        )
+    with col2:
+        if st.button("お気に入り登録", key='favorite_button'):
+            if save_favorite_property(st.session_state['username'], page_df.at[idx, '物件ID']):
+                st.success(f"{page_df.at[idx, '名称']}をお気に入りに追加しました")
+            else:
+                st.info(f"{page_df.at[idx, '名称']}は登録済みです")
+
+# 計測パネルを表示するか（DEBUG_PANEL=1、またはURLに?debug=1を付けた時）
+def debug_panel_enabled():
+    return os.getenv('DEBUG_PANEL') == '1' or st.query_params.get('debug') == '1'
+
+# サイドバーに計測パネルを表示する関数（パネルを開いている間は毎回計測する）
+def display_debug_panel(trace):
+    with st.sidebar.expander('■ 計測（デバッグ）', expanded=True):
+        st.checkbox('このセッションを毎回計測する', key='debug_panel')
+        st.caption(f"通常は{METRICS_SAMPLE_RATE:.0%}のリランだけを計測します")
+        if trace is None:
+            st.write("このリランは計測していません")
+            return
+        st.metric('リラン全体', f"{trace.total_ms:.1f} ms")
+        spans = sorted(trace.spans, key=lambda item: item['start_ms'])
+        st.dataframe(
+            pd.DataFrame({
+                '区間': ['　' * item['depth'] + item['name'] for item in spans],
+                '時間(ms)': [item['duration_ms'] for item in spans],
+            }),
+            column_config={'時間(ms)': st.column_config.NumberColumn(format='%.1f')},
+            hide_index=True,
+        )
+        if trace.counters:
+            st.dataframe(pd.Series(trace.counters, name='値').rename_axis('カウンタ').reset_index(), hide_index=True)
 
 # パスワードをハッシュ化
 def make_hashes(password):
@@ -89,62 +274,16 @@ def check_hashes(password, hashed_text):
         return hashed_text
     return False
 
-# ユーザー登録、ユーザー追加、ログイン機能実装
-def create_user():
-    conn = sqlite3.connect('password.db')
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS userstable(username TEXT, password TEXT)')
-    conn.commit()
-    conn.close()
-
-def add_user(username, password):
-    conn = sqlite3.connect('password.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO userstable(username, password) VALUES (?, ?)', (username, password))
-    conn.commit()
-    conn.close()
-
-def login_user(username, password):
-    conn = sqlite3.connect('password.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM userstable WHERE username =? AND password = ?', (username, password))
-    data = c.fetchall()
-    conn.close()
-    return data
-
-# お気に入り物件を保存する関数
-def save_favorite_property(username, property_id):
-    conn = sqlite3.connect('password.db')
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS favorite_properties(username TEXT, property_id INTEGER)')
-    c.execute('INSERT INTO favorite_properties(username, property_id) VALUES (?, ?)', (username, property_id))
-    conn.commit()
-    conn.close()
-
-# お気に入り物件を取得する関数
-def get_favorite_properties(username):
-    conn = sqlite3.connect('password.db')
-    c = conn.cursor()
-    c.execute('SELECT property_id FROM favorite_properties WHERE username = ?', (username,))
-    data = c.fetchall()
-    conn.close()
-    return [item[0] for item in data]
-
-# お気に入り物件を削除する関数
-def remove_favorite_property(username, property_id):
-    conn = sqlite3.connect('password.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM favorite_properties WHERE username = ? AND property_id = ?', (username, property_id))
-    conn.commit()
-    conn.close()
-
 # メインのアプリケーション
 def main():
+    # リランごとの計測（一部のリランだけを抜き出して計測し、計測パネルを開いている時は毎回計測する）
+    debug = debug_panel_enabled()
+    start_trace('main', force=debug and st.session_state.get('debug_panel', False))
     db_path = "chintai.db"
     table_name = "properties"  # テーブル名をここに入力
-
-    df = load_data_from_sqlite(db_path, table_name)
-    df = preprocess_dataframe(df)
+    # ユーザーDBの接続プールとスキーマ移行（プロセス内で一度だけ実行される）
+    with span('init_repository'):
+        init_repository('password.db', db_path, table_name)
 
     # StreamlitのUI要素（スライダー、ボタンなど）の各表示設定
     st.title('賃貸物件情報の可視化')
@@ -158,7 +297,6 @@ def main():
         username = st.text_input("ユーザー名を入力してください")
         password = st.text_input("パスワードを入力してください", type='password')
         if st.button("ログインする"):
-            create_user()
             hashed_pswd = make_hashes(password)
             result = login_user(username, check_hashes(password, hashed_pswd))
             if result:
@@ -174,10 +312,11 @@ def main():
         new_user = st.sidebar.text_input("新しいユーザー名を入力してください")
         new_password = st.sidebar.text_input("新しいパスワードを入力してください", type='password')
         if st.sidebar.button("登録する"):
-            create_user()
-            add_user(new_user, make_hashes(new_password))
-            st.sidebar.success("アカウントの作成に成功しました")
-            st.sidebar.info("ログインしてください")
+            if add_user(new_user, make_hashes(new_password)):
+                st.sidebar.success("アカウントの作成に成功しました")
+                st.sidebar.info("ログインしてください")
+            else:
+                st.sidebar.warning("このユーザー名は既に使われています")
 
     elif choice == "物件を探す":
         st.subheader("物件を探してお気に入り登録しよう！")
@@ -190,60 +329,79 @@ def main():
     elif choice == "物件を決める":
         st.subheader("物件を決めよう！")
         if st.session_state['logged_in']:
-            favorite_properties = get_favorite_properties(st.session_state['username'])
-            if favorite_properties:
+            favorite_df = get_favorite_property_details(st.session_state['username'], table_name)
+            if not favorite_df.empty:
                 st.write("お気に入り物件:")
-                for property_id in favorite_properties:
-                    property_data = df[df.index == property_id]
-                    if not property_data.empty:
-                        st.write(property_data[['名称', 'アドレス', '家賃', '間取り']])
-                        if st.button(f"お気に入り解除 {property_data.iloc[0]['名称']}", key=f"remove_{property_id}"):
-                            remove_favorite_property(st.session_state['username'], property_id)
-                            st.success(f"{property_data.iloc[0]['名称']}をお気に入りから解除しました")
+                st.dataframe(favorite_df[['名称', 'アドレス', '家賃', '間取り']], hide_index=True, use_container_width=True)
+                remove_ids = st.multiselect(
+                    'お気に入りから解除する物件',
+                    favorite_df['物件ID'].tolist(),
+                    format_func=lambda property_id: favorite_df.loc[favorite_df['物件ID'] == property_id, '名称'].iloc[0],
+                    key='remove_select'
+                )
+                if st.button("お気に入り解除", key='remove_button') and remove_ids:
+                    removed = remove_favorite_properties(st.session_state['username'], remove_ids)
+                    st.success(f"{removed}件の物件をお気に入りから解除しました")
         else:
             st.warning("ログインしてください")
 
     if st.session_state['logged_in'] and choice == "物件を探す":
+        # 選択肢はDBから集計した小さな結果だけを使う（全件は読み込まない）
+        with span('filter_options'):
+            options = get_filter_options(db_path, table_name)
+        count('table_rows', options['total'])
         col1, col2 = st.columns([1, 2])
         with col1:
-            area = st.multiselect('■ エリア選択', df['区'].unique(), default=[])
+            area = st.multiselect('■ エリア選択', options['areas'], default=[])
         with col2:
             price_min = st.number_input(
                 '■ 家賃下限 (万円)',
                 min_value=int(1),
-                max_value=int(df['家賃'].max()),
-                value=int(df['家賃'].min()),
+                max_value=int(options['price_max']),
+                value=int(options['price_min']),
                 step=1
             )
             price_max = st.number_input(
                 '■ 家賃上限 (万円)',
                 min_value=int(1),
-                max_value=int(df['家賃'].max()),
-                value=int(df['家賃'].max()),
+                max_value=int(options['price_max']),
+                value=int(options['price_max']),
                 step=1
             )
         with col2:
-            type_options = st.multiselect('■ 間取り選択', df['間取り'].unique(), default=['2LDK', '3LDK'])
+            type_options = st.multiselect('■ 間取り選択', options['layouts'], default=['2LDK', '3LDK'])
+        location = location_filter_inputs(db_path, table_name, options['stations'])
 
-        filtered_df = df[(df['区'].isin(area)) & (df['間取り'].isin(type_options))]
-        filtered_df = filtered_df[(filtered_df['家賃'] >= price_min) & (filtered_df['家賃'] <= price_max)]
+        # 条件をSQLのWHERE句に変換し、該当する物件だけを取得する（場所の条件は空間インデックス・駅の索引を使う）
+        with span('query_properties'):
+            filtered_df = query_properties(db_path, table_name, area, type_options, price_min, price_max, **location)
         filtered_count = len(filtered_df)
 
-        filtered_df['緯度'] = pd.to_numeric(filtered_df['緯度'], errors='coerce')
-        filtered_df['経度'] = pd.to_numeric(filtered_df['経度'], errors='coerce')
         filtered_df2 = filtered_df.dropna(subset=['緯度', '経度'])
-        filtered_df['物件詳細URL'] = filtered_df['物件詳細URL'].apply(lambda x: make_clickable(x, "リンク"))
+        # 相場は取り込み時に集計した小さな表から読む
+        with span('market_stats'):
+            market_stats = get_market_stats(db_path, table_name)
+            if market_stats is not None:
+                display_market_stats(market_stats)
 
         col2_1, col2_2 = st.columns([1, 2])
         with col2_2:
-            st.write(f"物件検索数: {filtered_count}件 / 全{len(df)}件")
+            st.write(f"物件検索数: {filtered_count}件 / 全{options['total']}件")
         if col2_1.button('検索＆更新', key='search_button'):
             st.session_state['filtered_df'] = filtered_df
             st.session_state['filtered_df2'] = filtered_df2
             st.session_state['search_clicked'] = True
         if st.session_state.get('search_clicked', False):
-            m = create_map(st.session_state.get('filtered_df2', filtered_df2))
-            folium_static(m)
+            map_modes = {'自動': 'auto', 'マーカー': 'cluster', 'ヒートマップ': 'heatmap'}
+            map_mode = st.radio('■ 地図の表示方法', list(map_modes), horizontal=True, key='map_mode')
+            m = create_map(st.session_state.get('filtered_df2', filtered_df2), mode=map_modes[map_mode])
+            # 表示範囲は「地図の表示範囲」で絞り込む時だけ受け取る
+            # 受け取ると地図を動かすたびに再実行されるため、他の絞り込み方法では何も受け取らない
+            track_bounds = st.session_state.get('location_filter') == '地図の表示範囲'
+            with span('map_render'):
+                map_state = st_folium(m, width=700, returned_objects=['bounds'] if track_bounds else [], key='result_map')
+            if map_state and map_state.get('bounds'):
+                st.session_state['map_bounds'] = map_state['bounds']
         
         show_all_option = st.radio(
         "表示オプションを選択してください:",
@@ -254,9 +412,13 @@ def main():
         st.session_state['show_all'] = (show_all_option == 'すべての検索物件')
         if st.session_state.get('search_clicked', False):
             if st.session_state['show_all']:
-                display_search_results(st.session_state.get('filtered_df', filtered_df))
+                display_search_results(st.session_state.get('filtered_df', filtered_df), market_stats)
             else:
-                display_search_results(st.session_state.get('filtered_df2', filtered_df2))
+                display_search_results(st.session_state.get('filtered_df2', filtered_df2), market_stats)
+
+    trace = finish_trace()
+    if debug:
+        display_debug_panel(trace)
 
 # アプリケーションの実行
 if __name__ == "__main__":
@@ -0,0 +1,175 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+# syntheticがアプリとスクレイパーのモジュールを読み込めるようにするため、最初に読み込む
+from synthetic import ROOT, generate_listing_records, load_fixtures, write_properties_db
+import pandas as pd
+import streamlit.logger
+
+streamlit.logger.set_log_level('error')
+logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+import app
+import property_store
+from dedupe import EntityResolver
+from normalize import normalize_frame
+from parsers import parse_pages
+from scrape_state import ScrapeState
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.data')
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+# 前回より遅くなったとみなす割合
+REGRESSION_THRESHOLD = 0.2
+
+# fnをrepeat回実行し、中央値と最小値（秒）を返す関数
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {'median': timings[len(timings) // 2], 'min': timings[0]}
+
+# 検索・地図・結果表示の処理時間を測る関数（rows件の合成データを使う）
+# 合成データのDBは作り直さずに使い回すため、一時ディレクトリにコピーしてから測る
+# （ensure_schemaが物件IDや索引を書き込むので、元のDBのままだと2回目以降は準備済みのDBを測ることになる）
+def bench_search(rows, repeat, seed):
+    source_path = write_properties_db(os.path.join(DATA_DIR, f'properties_{rows}_{seed}.db'), rows, seed)
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = shutil.copyfile(source_path, os.path.join(directory, 'properties.db'))
+        try:
+            return _bench_search(db_path, repeat)
+        finally:
+            property_store.clear_store()
+
+def _bench_search(db_path, repeat):
+    table_name = 'properties'
+    results = {}
+    # 物件IDと索引の準備は初回だけ行われるため、1回だけ測る
+    property_store.clear_store()
+    results['ensure_schema'] = measure(lambda: property_store.ensure_schema(db_path, table_name), 1)
+
+    df = property_store.load_data_from_sqlite(db_path, table_name)
+    results['load_data_from_sqlite'] = measure(lambda: property_store.load_data_from_sqlite(db_path, table_name), repeat)
+    results['preprocess_dataframe'] = measure(lambda: property_store.preprocess_dataframe(df.copy()), repeat)
+
+    # 検索画面の既定に近い条件（3区・2つの間取り・家賃の範囲）
+    options = property_store.get_filter_options(db_path, table_name)
+    filters = (options['areas'][:3], ['2LDK', '3LDK'], 5, 30)
+    results['query_properties'] = measure(lambda: property_store.query_properties(db_path, table_name, *filters), repeat)
+    results['query_properties_near'] = measure(
+        lambda: property_store.query_properties(db_path, table_name, near=(35.68, 139.76, 1000)), repeat)
+    results['query_properties_bbox'] = measure(
+        lambda: property_store.query_properties(db_path, table_name, bbox=(35.66, 139.74, 35.70, 139.78)), repeat)
+    station = options['stations'][0]
+    results['query_properties_station'] = measure(
+        lambda: property_store.query_properties(db_path, table_name, station=station, walk_max=5), repeat)
+
+    filtered_df = property_store.query_properties(db_path, table_name, *filters)
+    located_df = filtered_df.dropna(subset=['緯度', '経度'])
+    # 地図はHTMLにするまで（folium_staticと同じ処理）を測る
+    results['create_map'] = measure(lambda: app.create_map(located_df).get_root().render(), repeat)
+    results['create_map_all'] = measure(lambda: app.create_map(df.dropna(subset=['緯度', '経度'])).get_root().render(), repeat)
+    results['display_search_results'] = measure(lambda: app.display_search_results(filtered_df), repeat)
+    return results, {'filtered_rows': len(filtered_df)}
+
+# スクレイパーの解析・正規化・重複判定の処理時間を測る関数
+# 解析には合成の一覧ページ（benchmarks/fixtures）を使うため、実際のページの解析時間とは異なる
+def bench_scrape(pages, dedupe_rows, repeat, seed):
+    fixtures = load_fixtures()
+    jobs = [(site, f'https://example.com/{site}/?page={i}', html) for i in range(pages // 2) for site, html in fixtures.items()]
+    results = {}
+    results['parse_pages_inline'] = measure(lambda: [records for records in parse_pages(jobs, max_workers=1)], repeat)
+    results['parse_pages_pool'] = measure(lambda: [records for records in parse_pages(jobs)], repeat)
+    parsed = [record for records in parse_pages(jobs, max_workers=1) for record in records]
+    raw = pd.DataFrame(parsed).drop(columns=['カテゴリ'], errors='ignore')
+    results['normalize_frame'] = measure(lambda: normalize_frame(raw), repeat)
+
+    records = generate_listing_records(dedupe_rows, seed)
+    report = {}
+    def dedupe():
+        with tempfile.TemporaryDirectory() as directory:
+            state = ScrapeState(os.path.join(directory, 'bench.db'))
+            resolver = EntityResolver(state.conn, state.table_name)
+            for record in records:
+                resolver.is_duplicate(record)
+            report.update(resolver.report())
+            state.close()
+    results['dedupe'] = measure(dedupe, repeat)
+    return results, {'fixtures': 'synthetic', 'parsed_records': len(parsed), 'dedupe_records': len(records), 'duplicates': report.get('duplicates')}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+# 同じ条件の前回の結果を読み込む関数
+def _previous_results(path, key):
+    previous = None
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if (entry['suite'], entry['rows']) == key:
+                    previous = entry
+    return previous
+
+# 結果を表示し、前回から遅くなった処理に印を付ける関数
+def report(entry, previous):
+    print(f"\n[{entry['suite']}] rows={entry['rows']} {entry['info']}")
+    for name, timing in entry['results'].items():
+        line = f"  {name:<28} {timing['median'] * 1000:10.2f} ms (min {timing['min'] * 1000:.2f} ms)"
+        if previous and name in previous['results']:
+            before = previous['results'][name]['median']
+            change = timing['median'] / before - 1 if before else 0
+            line += f"  {change:+.0%} vs {previous['commit']}"
+            if change > REGRESSION_THRESHOLD:
+                line += '  <-- slower'
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='検索・地図・スクレイピングの処理時間を測る')
+    parser.add_argument('--rows', type=int, nargs='+', default=[4000, 100000], help='合成データの件数（4000〜1000000）')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pages', type=int, default=40, help='解析するページ数')
+    parser.add_argument('--dedupe-rows', type=int, default=20000, help='重複判定する物件数')
+    parser.add_argument('--suite', choices=['all', 'search', 'scrape'], default='all')
+    parser.add_argument('--output', default=RESULTS_PATH, help='結果を追記するファイル（JSON Lines）')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args()
+
+    runs = []
+    if args.suite in ('all', 'search'):
+        runs += [('search', rows, lambda rows=rows: bench_search(rows, args.repeat, args.seed)) for rows in args.rows]
+    if args.suite in ('all', 'scrape'):
+        runs.append(('scrape', args.dedupe_rows, lambda: bench_scrape(args.pages, args.dedupe_rows, args.repeat, args.seed)))
+
+    commit = _git_commit()
+    for suite, rows, bench in runs:
+        results, info = bench()
+        entry = {
+            'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'suite': suite,
+            'rows': rows,
+            'info': info,
+            'results': results,
+        }
+        report(entry, _previous_results(args.output, (suite, rows)))
+        if not args.no_save:
+            with open(args.output, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# アプリ（リポジトリ直下）とスクレイパー（定期実行）のモジュールを読み込めるようにする
+sys.path[:0] = [path for path in [ROOT, os.path.join(ROOT, '定期実行')] if path not in sys.path]
+
+from scrape_state import COLUMN_TYPES, GEO_COLUMNS
+
+# 合成データに使う区と町名・駅（chintai.dbの値に近いもの）
+WARDS = {
+    '千代田区': ['丸の内', '神田', '九段南'], '中央区': ['銀座', '日本橋', '月島'], '港区': ['芝浦', '西新橋', '海岸', '六本木'],
+    '新宿区': ['西新宿', '高田馬場', '四谷'], '文京区': ['本郷', '小石川'], '台東区': ['上野', '浅草'], '墨田区': ['押上', '錦糸'],
+    '江東区': ['豊洲', '大島'], '品川区': ['大崎', '西五反田'], '目黒区': ['中目黒', '自由が丘'], '大田区': ['蒲田', '大森北'],
+    '世田谷区': ['三軒茶屋', '経堂'], '渋谷区': ['恵比寿', '代々木'], '中野区': ['中野', '東中野'], '杉並区': ['高円寺南', '荻窪'],
+    '豊島区': ['池袋', '目白'], '北区': ['赤羽', '王子'], '荒川区': ['南千住', '西日暮里'], '板橋区': ['板橋', '成増'],
+    '練馬区': ['練馬', '石神井町'], '足立区': ['千住', '綾瀬'], '葛飾区': ['亀有', '金町'], '江戸川区': ['葛西', '小岩'],
+}
+STATIONS = [
+    ('JR山手線', '品川駅'), ('JR山手線', '田町駅'), ('JR山手線', '新橋駅'), ('JR山手線', '渋谷駅'), ('JR山手線', '池袋駅'),
+    ('東京メトロ日比谷線', '六本木駅'), ('東京メトロ日比谷線', '虎ノ門ヒルズ駅'), ('都営三田線', '御成門駅'),
+    ('都営大江戸線', '麻布十番駅'), ('東急東横線', '中目黒駅'), ('東京メトロ有楽町線', '豊洲駅'), ('新交通ゆりかもめ', '芝浦ふ頭駅'),
+    ('JR中央線', '中野駅'), ('JR中央線', '荻窪駅'), ('京成本線', '青砥駅'), ('東武伊勢崎線', '北千住駅'),
+]
+# 間取りと出現割合・面積の平均（m2）
+LAYOUTS = {
+    '1K': (0.29, 24), '1LDK': (0.28, 42), '2LDK': (0.13, 62), 'ワンルーム': (0.12, 20), '1DK': (0.08, 32),
+    '3LDK': (0.05, 78), '1SLDK': (0.02, 50), '2DK': (0.01, 45), '2K': (0.01, 35), '4LDK': (0.01, 95),
+}
+# 東京23区のおおよその範囲（南, 西, 北, 東）
+TOKYO_BBOX = (35.53, 139.56, 35.82, 139.92)
+
+FULLWIDTH_DIGITS = str.maketrans('0123456789', '０１２３４５６７８９')
+
+# chintai.dbと同じ列を持つ合成の物件データを作る関数（同じseedなら同じデータ）
+# offsetは名称・物件詳細URLの通し番号の開始位置（分割して作る時に使う）
+def generate_properties(n, seed=0, offset=0):
+    rng = np.random.default_rng(seed)
+    ward_names = list(WARDS)
+    wards = rng.choice(ward_names, n)
+    towns = np.array([WARDS[ward][i % len(WARDS[ward])] for ward, i in zip(wards, rng.integers(0, 4, n))])
+    chome = np.char.translate(rng.integers(1, 8, n).astype(str), FULLWIDTH_DIGITS)
+    layout_names = list(LAYOUTS)
+    layout_weights = np.array([LAYOUTS[name][0] for name in layout_names])
+    layouts = rng.choice(layout_names, n, p=layout_weights / layout_weights.sum())
+    areas = np.round(np.array([LAYOUTS[name][1] for name in layouts]) * rng.uniform(0.8, 1.25, n), 2)
+    rent = np.round(areas * rng.lognormal(np.log(0.45), 0.25, n), 1)
+    structure = rng.integers(2, 45, n)
+    df = pd.DataFrame({
+        '名称': [f'合成マンション{i}' for i in range(offset, offset + n)],
+        'アドレス': np.char.add(np.char.add(np.char.add('東京都', wards), towns), chome),
+        '築年数': rng.integers(0, 50, n),
+        '構造': structure,
+        '階数': (rng.random(n) * structure).astype(int) + 1,
+        '家賃': rent,
+        '管理費': rng.choice([0, 5000, 8000, 10000, 15000, 20000], n).astype(float),
+        '敷金': np.round(rent * rng.choice([0, 1, 2], n), 1),
+        '礼金': np.round(rent * rng.choice([0, 1], n), 1),
+        '間取り': layouts,
+        '面積': areas,
+        '物件画像URL': [f'https://img.example.com/{i}.jpg' for i in range(offset, offset + n)],
+        '間取画像URL': [f'https://img.example.com/{i}_plan.jpg' for i in range(offset, offset + n)],
+        '物件詳細URL': [f'https://www.homes.co.jp/chintai/room/{i:040x}/' for i in range(offset, offset + n)],
+        '区': wards,
+        '市町': towns,
+    })
+    access = []
+    for k in range(1, 4):
+        station = rng.integers(0, len(STATIONS), n)
+        walk = rng.integers(1, 20, n).astype(float)
+        df[f'アクセス{k}徒歩(分)'] = walk
+        df[f'アクセス{k}線路名'] = [STATIONS[i][0] for i in station]
+        df[f'アクセス{k}駅名'] = [STATIONS[i][1] for i in station]
+        access.append(df[f'アクセス{k}線路名'] + ' ' + df[f'アクセス{k}駅名'] + ' 徒歩' + walk.astype(int).astype(str) + '分')
+    df['アクセス'] = access[0] + ', ' + access[1] + ', ' + access[2]
+    south, west, north, east = TOKYO_BBOX
+    located = rng.random(n) > 0.1
+    df['緯度'] = np.where(located, rng.uniform(south, north, n), np.nan)
+    df['経度'] = np.where(located, rng.uniform(west, east, n), np.nan)
+    return df[list(COLUMN_TYPES) + GEO_COLUMNS]
+
+# 合成データのDBを作る関数（既にあれば作り直さない）
+def write_properties_db(path, n, seed=0, table_name='properties'):
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path + '.tmp')
+    for start in range(0, n, 100000):
+        chunk = generate_properties(min(100000, n - start), seed + start, offset=start)
+        chunk.to_sql(table_name, conn, index=False, if_exists='append')
+    conn.commit()
+    conn.close()
+    os.replace(path + '.tmp', path)
+    return path
+
+# 合成データを取り込み時（正規化後）の辞書に変換する関数
+# duplicate_rateの割合で、別サイトに掲載された同じ部屋（値が少しずれたもの）を加える
+def generate_listing_records(n, seed=0, duplicate_rate=0.2):
+    rng = np.random.default_rng(seed)
+    df = generate_properties(n, seed)
+    df['掲載ページ'] = 'https://www.homes.co.jp/chintai/tokyo/list/?page=1'
+    duplicates = df.sample(frac=duplicate_rate, random_state=seed).copy()
+    duplicates['物件詳細URL'] = [f'https://suumo.jp/chintai/jnc_{i:012d}/' for i in range(len(duplicates))]
+    duplicates['掲載ページ'] = 'https://suumo.jp/chintai/tokyo/sc_minato/?page=1'
+    duplicates['面積'] = np.round(duplicates['面積'] + rng.uniform(-0.3, 0.3, len(duplicates)), 2)
+    records = pd.concat([df, duplicates]).sample(frac=1, random_state=seed)
+    records = records.astype(object).where(records.notna(), None)
+    return records.to_dict('records')
+
+# homesの一覧ページの形のHTMLを作る関数（建物ごとにrooms部屋）
+def homes_page_html(buildings=30, rooms=3, seed=0):
+    rng = np.random.default_rng(seed)
+    items = []
+    for b in range(buildings):
+        room_rows = ''.join(
+            f'''<tr class="unitListBody prg-unitListBody"><td class="roomKaisuu">{rng.integers(1, 15)}階</td>
+            <td><span class="priceLabel">{rng.uniform(8, 30):.1f}万円</span>/{rng.choice([0, 5000, 10000]):,}円</td>
+            <td class="price">敷/礼<br/>{rng.choice(['無', '1ヶ月', '10万円'])}/{rng.choice(['無', '1ヶ月'])}</td>
+            <td class="layout">{rng.choice(list(LAYOUTS))}<br/>{rng.uniform(18, 80):.2f}m²</td>
+            <td><a href="/chintai/room/{seed:04d}{b:04d}{r:04d}/">詳細</a></td></tr>'''
+            for r in range(rooms)
+        )
+        ward = list(WARDS)[b % len(WARDS)]
+        items.append(f'''<div class="mod-mergeBuilding--rent--photo"><div class="moduleInner">
+            <h2><span class="bukkenName">合成レジデンス{b}</span></h2>
+            <div class="bukkenPhoto"><div class="photo"><img data-original="https://img.example.com/h{b}.jpg"/></div></div>
+            <div class="moduleBody"><table><tr><th>所在地</th><td>東京都{ward}{WARDS[ward][0]}{b % 5 + 1}</td></tr>
+            <tr><th>交通</th><td class="traffic">JR山手線 田町駅 徒歩{b % 15 + 1}分, 都営三田線 三田駅 徒歩{b % 12 + 3}分</td></tr>
+            <tr><th>築年数/階数</th><td>築{b % 40}年 / {b % 30 + 3}階建</td></tr></table>
+            <div class="floarPlanPic"><img data-original="https://img.example.com/h{b}_plan.jpg"/></div></div>
+            <table class="unitList"><tbody>{room_rows}</tbody></table></div></div>''')
+    return '<html><head><title>homes</title></head><body><div id="prg-mod-bukkenList">' + ''.join(items) + '</div></body></html>'
+
+# スーモの一覧ページの形のHTMLを作る関数（建物ごとにrooms部屋）
+def suumo_page_html(buildings=30, rooms=3, seed=0):
+    rng = np.random.default_rng(seed)
+    items = []
+    for b in range(buildings):
+        room_rows = ''.join(
+            f'''<tbody><tr class="js-cassette_link"><td></td><td class="casssetteitem_other-thumbnail"><img rel="https://img.example.com/s{b}_{r}.jpg"/></td>
+            <td>{rng.integers(1, 15)}階</td>
+            <td><span class="cassetteitem_other-emphasis ui-text--bold"><span class="cassetteitem_price cassetteitem_price--rent">{rng.uniform(8, 30):.1f}万円</span></span>
+            <span class="cassetteitem_price cassetteitem_price--administration">{rng.choice([0, 5000, 10000])}円</span></td>
+            <td><span class="cassetteitem_price cassetteitem_price--deposit">{rng.choice(['-', '10万円'])}</span>
+            <span class="cassetteitem_price cassetteitem_price--gratuity">{rng.choice(['-', '10万円'])}</span></td>
+            <td><span class="cassetteitem_madori">{rng.choice(list(LAYOUTS))}</span><span class="cassetteitem_menseki">{rng.uniform(18, 80):.2f}m<sup>2</sup></span></td>
+            <td><a href="/chintai/jnc_{seed:04d}{b:04d}{r:04d}/">詳細を見る</a></td></tr></tbody>'''
+            for r in range(rooms)
+        )
+        ward = list(WARDS)[b % len(WARDS)]
+        items.append(f'''<div class="cassetteitem"><div class="cassetteitem-detail">
+            <div class="cassetteitem-detail-object"><div class="cassetteitem_object-item"><img rel="https://img.example.com/s{b}.jpg"/></div></div>
+            <div class="cassetteitem-detail-body"><div class="cassetteitem_content">
+            <div class="cassetteitem_content-label"><span class="ui-pct ui-pct--util1">賃貸マンション</span></div>
+            <div class="cassetteitem_content-title">合成ハイツ{b}</div></div>
+            <ul class="cassetteitem_detail"><li class="cassetteitem_detail-col1">東京都{ward}{WARDS[ward][0]}{b % 5 + 1}</li>
+            <li class="cassetteitem_detail-col2"><div class="cassetteitem_detail-text">ＪＲ山手線/田町駅 歩{b % 15 + 1}分</div>
+            <div class="cassetteitem_detail-text">都営三田線/三田駅 歩{b % 12 + 3}分</div></li>
+            <li class="cassetteitem_detail-col3"><div>築{b % 40}年</div><div>{b % 30 + 3}階建</div></li></ul></div></div>
+            <div class="cassetteitem-item"><table class="cassetteitem_other">{room_rows}</table></div></div>''')
+    return '<html><head><title>suumo</title></head><body><div id="js-bukkenList">' + ''.join(items) + '</div></body></html>'
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# フィクスチャは上の関数で作った合成ページで、実際のサイトから保存したものではない
+# パーサーが使うセレクタだけを持つため、実際のページより小さく、解析の時間は実際より短く出る
+FIXTURES = {'homes': 'homes_list_synthetic.html', 'suumo': 'suumo_list_synthetic.html'}
+FIXTURE_NOTE = '<!-- 合成データ: benchmarks/synthetic.py で生成したページ（実際のサイトのページではない） -->\n'
+
+# 解析のベンチマークに使う合成の一覧ページ（サイト -> HTML）を読み込む関数
+def load_fixtures():
+    fixtures = {}
+    for site, name in FIXTURES.items():
+        with open(os.path.join(FIXTURE_DIR, name), encoding='utf-8') as f:
+            fixtures[site] = f.read()
+    return fixtures
+
+# 合成の一覧ページのフィクスチャを作り直す（python benchmarks/synthetic.py）
+if __name__ == '__main__':
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    for site, make_html in [('homes', homes_page_html), ('suumo', suumo_page_html)]:
+        with open(os.path.join(FIXTURE_DIR, FIXTURES[site]), 'w', encoding='utf-8') as f:
+            f.write(FIXTURE_NOTE + make_html())
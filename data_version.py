@@ -0,0 +1,16 @@
+import os
+import sqlite3
+
+# データのバージョンを取得する関数（ファイルの更新時刻とPRAGMA user_versionの組）
+def get_data_version(db_path):
+    mtime = os.path.getmtime(db_path)
+    conn = sqlite3.connect(db_path)
+    user_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.close()
+    return (mtime, user_version)
+
+# データ更新時にバージョン番号を上げる関数
+# 取り込み処理（物件の追加・更新、掲載終了、座標の補完、相場表の更新）から、コミットする前に呼び出す
+def bump_data_version(conn):
+    user_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.execute(f'PRAGMA user_version = {user_version + 1}')
@@ -0,0 +1,102 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# 計測するリランの割合（0〜1。デバッグパネルを開いているセッションは常に計測する）
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '0.01'))
+# 計測結果をJSON Linesで追記するファイル（指定がなければログだけに出す）
+METRICS_PATH = os.getenv('METRICS_PATH')
+
+# 計測結果は1行1件のJSONとして標準エラーに出力する
+logger = logging.getLogger('chintai.metrics')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# 実行中のリランの計測（計測しないリランではNone）
+_current = contextvars.ContextVar('trace', default=None)
+
+# 1回のリランの計測結果（区間ごとの時間とカウンタ）
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        self.start = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.depth = 0
+        self.total_ms = None
+
+    def to_dict(self):
+        return {
+            'trace': self.name,
+            'started_at': self.started_at,
+            'total_ms': self.total_ms,
+            'spans': self.spans,
+            'counters': self.counters,
+        }
+
+# リランの計測を始める関数（force=Trueか、METRICS_SAMPLE_RATEの確率で計測する）
+def start_trace(name, force=False):
+    trace = Trace(name) if force or random.random() < METRICS_SAMPLE_RATE else None
+    _current.set(trace)
+    return trace
+
+# リランの計測を終えて、構造化ログ（とMETRICS_PATHのファイル）に出力する関数
+def finish_trace():
+    trace = _current.get()
+    if trace is None:
+        return None
+    _current.set(None)
+    trace.total_ms = (time.perf_counter() - trace.start) * 1000
+    line = json.dumps(trace.to_dict(), ensure_ascii=False)
+    logger.info(line)
+    if METRICS_PATH:
+        with open(METRICS_PATH, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    return trace
+
+# 処理の区間の時間を測るコンテキストマネージャ（計測しないリランでは何もしない）
+@contextmanager
+def span(name):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    trace.depth += 1
+    try:
+        yield
+    finally:
+        trace.depth -= 1
+        trace.spans.append({
+            'name': name,
+            'depth': trace.depth,
+            'start_ms': (start - trace.start) * 1000,
+            'duration_ms': (time.perf_counter() - start) * 1000,
+        })
+
+# カウンタに値を足す関数（読み込んだ行数・返した行数など）
+def count(name, value=1):
+    trace = _current.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + value
+
+# 関数全体をspanで囲むデコレータ
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
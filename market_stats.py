@@ -0,0 +1,83 @@
+import sys
+import sqlite3
+from datetime import datetime, timezone
+import pandas as pd
+from data_version import bump_data_version
+
+# 相場表のテーブル名
+MARKET_STATS_TABLE = 'market_stats'
+# 集計の単位（集計単位 -> グループ化する列）。駅は最寄り駅（アクセス1）を使う
+GROUPINGS = {
+    '区': ['区'],
+    '区×間取り': ['区', '間取り'],
+    '区×間取り×駅': ['区', '間取り', '駅名'],
+}
+# 求めるパーセンタイル
+PERCENTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+# 集計する値（家賃は万円、平米単価は円/m2）
+VALUE_COLUMNS = ['家賃', '平米単価']
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _percentile_name(value, q):
+    return f'{value}_中央値' if q == 0.5 else f'{value}_p{int(q * 100)}'
+
+STATS_COLUMNS = ['集計単位', '区', '間取り', '駅名', '件数'] + [
+    _percentile_name(value, q) for value in VALUE_COLUMNS for q in PERCENTILES
+] + ['緯度', '経度', 'updated_at']
+
+# 掲載中の物件から集計に使う列だけを読み込む関数
+def _load_values(conn, table_name):
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table_name})')}
+    active = 'AND "掲載終了" IS NULL' if '掲載終了' in columns else ''
+    df = pd.read_sql_query(
+        f'SELECT "区", "間取り", "アクセス1駅名" AS 駅名, "家賃", "面積", "緯度", "経度" FROM {table_name} '
+        f'WHERE "家賃" IS NOT NULL AND "区" IS NOT NULL {active}',
+        conn
+    )
+    # 0件や値がすべてNULLの列はobject型で読み込まれるため、数値の列は型を揃える
+    df[['家賃', '面積', '緯度', '経度']] = df[['家賃', '面積', '緯度', '経度']].astype(float)
+    df['平米単価'] = (df['家賃'] * 10000 / df['面積']).where(df['面積'] > 0)
+    return df
+
+# 区・間取り・駅ごとの相場（件数・家賃と平米単価のパーセンタイル）を集計する関数
+# 掲載中の物件がない時（初回の取り込みで1件も取得できなかった時など）は空の表を返す
+def compute_market_stats(df):
+    if df.empty:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+    frames = []
+    for level, keys in GROUPINGS.items():
+        grouped = df.dropna(subset=keys).groupby(keys, observed=True)
+        stats = grouped[VALUE_COLUMNS].quantile(PERCENTILES).unstack()
+        stats.columns = [_percentile_name(value, q) for value, q in stats.columns]
+        stats['件数'] = grouped.size()
+        # 区の中心（地図の表示用）
+        stats[['緯度', '経度']] = grouped[['緯度', '経度']].mean()
+        stats = stats.reset_index()
+        stats['集計単位'] = level
+        frames.append(stats)
+    result = pd.concat(frames, ignore_index=True)
+    result['updated_at'] = now_iso()
+    return result.reindex(columns=STATS_COLUMNS)
+
+# 相場表を作り直す関数（取り込みの最後に呼ぶ。アプリはこの小さな表だけを読む）
+def refresh_market_stats(conn, table_name='properties'):
+    stats = compute_market_stats(_load_values(conn, table_name))
+    # 新しい表を作ってから一つのトランザクションで入れ替え、読み込み中のアプリに空の表を見せない
+    stats.to_sql(f'{MARKET_STATS_TABLE}_new', conn, index=False, if_exists='replace')
+    conn.commit()
+    conn.execute('BEGIN')
+    conn.execute(f'DROP TABLE IF EXISTS {MARKET_STATS_TABLE}')
+    conn.execute(f'ALTER TABLE {MARKET_STATS_TABLE}_new RENAME TO {MARKET_STATS_TABLE}')
+    conn.execute(f'CREATE INDEX idx_{MARKET_STATS_TABLE}_key ON {MARKET_STATS_TABLE}("集計単位", "区", "間取り", "駅名")')
+    bump_data_version(conn)
+    conn.commit()
+    return len(stats)
+
+# 既存のDBの相場表を作る（例：python market_stats.py chintai.db）
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'minatoku.db'
+    conn = sqlite3.connect(db_path)
+    print(f"{refresh_market_stats(conn)} rows written to {MARKET_STATS_TABLE}")
+    conn.close()
@@ -0,0 +1,312 @@
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+from access import ACCESS_COUNT, split_access
+from data_version import get_data_version
+from instrumentation import count, span
+from market_stats import MARKET_STATS_TABLE, refresh_market_stats
+
+# プロセス内で共有するデータ（キー -> (バージョン, 値)）
+_store = {}
+_store_lock = threading.Lock()
+# スキーマ準備済みのDB（キー -> 準備した後のバージョン。DBが更新・置き換えられたら準備し直す）
+_prepared = {}
+_prepared_lock = threading.Lock()
+
+# 物件IDの列名
+PROPERTY_ID_COLUMN = '物件ID'
+# 物件IDの元にする列（物件詳細URLが部屋単位の行。念のため部屋を区別する列も加える）
+PROPERTY_ID_SOURCE_COLUMNS = ['物件詳細URL', '階数', '間取り', '面積']
+# 物件詳細URLが建物単位の行（部屋ごとのリンクがない時・旧形式のDB）は家賃も加え、同じ階・間取り・面積の部屋を区別する
+PROPERTY_ID_FALLBACK_COLUMNS = PROPERTY_ID_SOURCE_COLUMNS + ['家賃']
+# スクレイパーが付ける物件キーの列名（値は物件IDと同じ）
+LISTING_KEY_COLUMN = '物件キー'
+
+# 検索用のインデックス
+PROPERTY_INDEXES = {
+    'idx_properties_area_layout_rent': ['区', '間取り', '家賃'],
+    'idx_properties_rent': ['家賃'],
+    'idx_properties_latlon': ['緯度', '経度'],
+    'idx_properties_station1': ['アクセス1駅名', 'アクセス1徒歩(分)'],
+    'idx_properties_station2': ['アクセス2駅名', 'アクセス2徒歩(分)'],
+    'idx_properties_station3': ['アクセス3駅名', 'アクセス3徒歩(分)'],
+}
+
+# 駅の位置は、この分数以内で歩ける物件の座標の平均とする（DBに駅の座標がないため）
+STATION_LOCATION_WALK = 5
+# 地球の半径（m）
+EARTH_RADIUS = 6371000.0
+
+# SQLiteデータベースからデータを読み込む関数
+def load_data_from_sqlite(db_path, table_name):
+    conn = sqlite3.connect(db_path)
+    query = f"SELECT * FROM {table_name}"
+    df = pd.read_sql_query(query, conn)
+    conn.close()
+    return df
+
+# 家賃は取り込み時に数値へ正規化されているため、文字列の時だけ変換する
+def preprocess_dataframe(df):
+    if not pd.api.types.is_numeric_dtype(df['家賃']):
+        df['家賃'] = pd.to_numeric(df['家賃'], errors='coerce')
+    df = df.dropna(subset=['家賃'])
+    return df
+
+# 共有ストアから値を取得する関数
+# 初回とDBのバージョンが変わった時だけloaderを呼び、それ以外は読み込み済みの値を返す
+def _get_cached(key, db_path, loader):
+    version = get_data_version(db_path)
+    cached = _store.get(key)
+    if cached is not None and cached[0] == version:
+        count('store_hits')
+        return cached[1]
+    with _store_lock:
+        cached = _store.get(key)
+        if cached is not None and cached[0] == version:
+            count('store_hits')
+            return cached[1]
+        count('store_misses')
+        with span(f'store_load:{key[0]}'):
+            value = loader()
+        _store[key] = (version, value)
+        return value
+
+# 検索画面の選択肢（区・間取りの一覧、家賃の範囲、全件数）を取得する関数
+def get_filter_options(db_path, table_name):
+    ensure_schema(db_path, table_name)
+    def loader():
+        conn = sqlite3.connect(db_path)
+        areas = [row[0] for row in conn.execute(f'SELECT DISTINCT "区" FROM {table_name} WHERE "家賃" IS NOT NULL AND "区" IS NOT NULL')]
+        layouts = [row[0] for row in conn.execute(f'SELECT DISTINCT "間取り" FROM {table_name} WHERE "家賃" IS NOT NULL AND "間取り" IS NOT NULL')]
+        price_min, price_max, total = conn.execute(f'SELECT MIN("家賃"), MAX("家賃"), COUNT(*) FROM {table_name} WHERE "家賃" IS NOT NULL').fetchone()
+        station_query = ' UNION '.join(
+            f'SELECT "アクセス{i}駅名" FROM {table_name} WHERE "アクセス{i}駅名" IS NOT NULL' for i in range(1, ACCESS_COUNT + 1)
+        )
+        stations = sorted(row[0] for row in conn.execute(station_query))
+        conn.close()
+        return {'areas': areas, 'layouts': layouts, 'price_min': price_min, 'price_max': price_max, 'total': total, 'stations': stations}
+    return _get_cached(('filter_options', db_path, table_name), db_path, loader)
+
+# 駅の推定位置（駅名 -> (緯度, 経度)）を取得する関数
+def get_station_locations(db_path, table_name):
+    ensure_schema(db_path, table_name)
+    def loader():
+        conn = sqlite3.connect(db_path)
+        near_rows = ' UNION ALL '.join(
+            f'SELECT "アクセス{i}駅名" AS 駅名, "緯度", "経度" FROM {table_name} '
+            f'WHERE "アクセス{i}徒歩(分)" <= {STATION_LOCATION_WALK} AND "緯度" IS NOT NULL AND "経度" IS NOT NULL'
+            for i in range(1, ACCESS_COUNT + 1)
+        )
+        rows = conn.execute(f'SELECT 駅名, AVG("緯度"), AVG("経度") FROM ({near_rows}) GROUP BY 駅名').fetchall()
+        conn.close()
+        return {row[0]: (row[1], row[2]) for row in rows}
+    return _get_cached(('station_locations', db_path, table_name), db_path, loader)
+
+# 相場表（取り込み時に作成されるmarket_stats）を取得する関数（表が空ならNone）
+def get_market_stats(db_path, table_name):
+    ensure_schema(db_path, table_name)
+    def loader():
+        conn = sqlite3.connect(db_path)
+        df = pd.read_sql_query(f'SELECT * FROM {MARKET_STATS_TABLE}', conn)
+        conn.close()
+        return df if len(df) else None
+    return _get_cached(('market_stats', db_path, table_name), db_path, loader)
+
+# 家賃が区の中央値より何%高いか（マイナスは安い）を求める関数
+def compare_to_ward_median(df, market_stats):
+    ward_medians = market_stats[market_stats['集計単位'] == '区'].set_index('区')['家賃_中央値']
+    medians = df['区'].astype(object).map(ward_medians)
+    return (df['家賃'].astype(float) / medians - 1) * 100
+
+# 物件IDを作成する関数（物件の内容から求めるため、再スクレイピングで行の順番が変わっても変わらない）
+# スクレイパーの物件キーも同じ関数で求める
+def make_property_id(values):
+    key = '|'.join('' if value is None else str(value) for value in values)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+# 物件IDが未設定の行にIDを付け、UNIQUE制約を作成する関数
+# スクレイパーが付けた物件キー（物件IDと同じ求め方）があればそれを使う
+# 物件キーのないテーブル（旧形式のchintai.db）は物件詳細URLが建物単位のため、家賃も加えて求める
+# 家賃まで全く同じ部屋だけは区別できないため、出現順に「-2」「-3」…を付ける
+def ensure_property_ids(conn, table_name):
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info({table_name})')]
+    if PROPERTY_ID_COLUMN not in columns:
+        conn.execute(f'ALTER TABLE {table_name} ADD COLUMN "{PROPERTY_ID_COLUMN}" TEXT')
+    used = {row[0] for row in conn.execute(f'SELECT "{PROPERTY_ID_COLUMN}" FROM {table_name} WHERE "{PROPERTY_ID_COLUMN}" IS NOT NULL')}
+    listing_key = f'"{LISTING_KEY_COLUMN}"' if LISTING_KEY_COLUMN in columns else 'NULL'
+    source_columns = ', '.join(f'"{col}"' for col in PROPERTY_ID_FALLBACK_COLUMNS)
+    rows = conn.execute(
+        f'SELECT rowid, {listing_key}, {source_columns} FROM {table_name} WHERE "{PROPERTY_ID_COLUMN}" IS NULL ORDER BY rowid'
+    ).fetchall()
+    updates = []
+    for row in rows:
+        base_id = row[1] or make_property_id(row[2:])
+        property_id = base_id
+        n = 1
+        while property_id in used:
+            n += 1
+            property_id = f'{base_id}-{n}'
+        used.add(property_id)
+        updates.append((property_id, row[0]))
+    conn.executemany(f'UPDATE {table_name} SET "{PROPERTY_ID_COLUMN}" = ? WHERE rowid = ?', updates)
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_properties_id ON {table_name}("{PROPERTY_ID_COLUMN}")')
+
+# 駅名の列に線路名（「JR山手線駅」など）が入っている行を、アクセスの文字列から解析し直す関数
+# 旧形式のchintai.dbはアクセスを正しく分けられておらず、駅の検索と駅の位置が線路単位になってしまうため
+def repair_station_names(conn, table_name):
+    broken = ' OR '.join(f'"アクセス{i}駅名" = "アクセス{i}線路名" || \'駅\'' for i in range(1, ACCESS_COUNT + 1))
+    df = pd.read_sql_query(f'SELECT rowid, "アクセス" FROM {table_name} WHERE {broken}', conn)
+    if df.empty:
+        return
+    access = split_access(df['アクセス'])
+    access = access.astype(object).where(access.notna(), None)
+    set_clause = ', '.join(f'"{col}" = ?' for col in access.columns)
+    conn.executemany(
+        f'UPDATE {table_name} SET {set_clause} WHERE rowid = ?',
+        [(*values, rowid) for values, rowid in zip(access.itertuples(index=False), df['rowid'].tolist())]
+    )
+
+# 座標の空間インデックス（SQLiteのR*Tree）を作成する関数
+# 物件テーブルの追加・更新・削除はトリガーで反映する
+# トリガーがない時（テーブルを作り直した時）と件数が合わない時は作り直す
+def ensure_spatial_index(conn, table_name):
+    rtree = f'{table_name}_rtree'
+    has_triggers = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f'{rtree}_insert',)
+    ).fetchone() is not None
+    conn.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, min_lat, max_lat, min_lon, max_lon)')
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_insert AFTER INSERT ON {table_name}
+        WHEN new."緯度" IS NOT NULL AND new."経度" IS NOT NULL BEGIN
+            INSERT OR REPLACE INTO {rtree} VALUES (new.rowid, new."緯度", new."緯度", new."経度", new."経度");
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_update AFTER UPDATE OF "緯度", "経度" ON {table_name} BEGIN
+            DELETE FROM {rtree} WHERE id = old.rowid;
+            INSERT INTO {rtree} SELECT new.rowid, new."緯度", new."緯度", new."経度", new."経度"
+            WHERE new."緯度" IS NOT NULL AND new."経度" IS NOT NULL;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {rtree}_delete AFTER DELETE ON {table_name} BEGIN
+            DELETE FROM {rtree} WHERE id = old.rowid;
+        END
+    """)
+    indexed = conn.execute(f'SELECT COUNT(*) FROM {rtree}').fetchone()[0]
+    located = conn.execute(f'SELECT COUNT(*) FROM {table_name} WHERE "緯度" IS NOT NULL AND "経度" IS NOT NULL').fetchone()[0]
+    if not has_triggers or indexed != located:
+        conn.execute(f'DELETE FROM {rtree}')
+        conn.execute(f"""
+            INSERT INTO {rtree} SELECT rowid, "緯度", "緯度", "経度", "経度" FROM {table_name}
+            WHERE "緯度" IS NOT NULL AND "経度" IS NOT NULL
+        """)
+
+# 物件IDと検索用のインデックス・相場表を準備し、準備した後のデータのバージョンを返す関数
+# 準備は初回とDBのバージョンが変わった時（取り込みやテーブルの置き換え）だけ行う
+def ensure_schema(db_path, table_name):
+    key = (db_path, table_name)
+    version = get_data_version(db_path)
+    if _prepared.get(key) == version:
+        return version
+    with _prepared_lock:
+        version = get_data_version(db_path)
+        if _prepared.get(key) == version:
+            return version
+        with span('ensure_schema'):
+            conn = sqlite3.connect(db_path)
+            ensure_property_ids(conn, table_name)
+            repair_station_names(conn, table_name)
+            for index_name, columns in PROPERTY_INDEXES.items():
+                column_list = ', '.join(f'"{col}"' for col in columns)
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name}({column_list})')
+            ensure_spatial_index(conn, table_name)
+            conn.commit()
+            # 相場表も作り直す（取り込みで作られていないDBや、テーブルを置き換えたDBでも古い相場を見せない）
+            refresh_market_stats(conn, table_name)
+            conn.close()
+        # 準備でDBが更新された場合は、更新後のバージョンを記録する
+        version = get_data_version(db_path)
+        _prepared[key] = version
+        return version
+
+# 中心から半径radius_m以内を含む範囲（南, 西, 北, 東）を求める関数
+def radius_bbox(lat, lon, radius_m):
+    dlat = np.degrees(radius_m / EARTH_RADIUS)
+    dlon = np.degrees(radius_m / (EARTH_RADIUS * np.cos(np.radians(lat))))
+    return (lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+# 1点から複数の点までの距離（m）を求める関数
+def haversine_m(lat, lon, lats, lons):
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+# 検索条件からWHERE句とパラメータを組み立てる関数
+# bboxは（南, 西, 北, 東）の範囲で、空間インデックスから候補を絞ってから座標で確かめる
+# stationとwalk_maxは、アクセス1〜3のいずれかがその駅から徒歩walk_max分以内の物件に絞る
+def build_where_clause(areas, layouts, price_min, price_max, bbox=None, station=None, walk_max=None, table_name='properties'):
+    conditions = []
+    params = []
+    if areas is not None:
+        conditions.append(f'"区" IN ({", ".join("?" for _ in areas)})' if areas else '0')
+        params.extend(areas)
+    if layouts is not None:
+        conditions.append(f'"間取り" IN ({", ".join("?" for _ in layouts)})' if layouts else '0')
+        params.extend(layouts)
+    if price_min is not None:
+        conditions.append('"家賃" >= ?')
+        params.append(price_min)
+    if price_max is not None:
+        conditions.append('"家賃" <= ?')
+        params.append(price_max)
+    if bbox is not None:
+        south, west, north, east = bbox
+        conditions.append(
+            f'rowid IN (SELECT id FROM {table_name}_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)'
+            ' AND "緯度" BETWEEN ? AND ? AND "経度" BETWEEN ? AND ?'
+        )
+        params.extend([south, north, west, east, south, north, west, east])
+    if station is not None:
+        walk = ' AND "アクセス{i}徒歩(分)" <= ?' if walk_max is not None else ''
+        conditions.append('(' + ' OR '.join(
+            f'("アクセス{i}駅名" = ?{walk.format(i=i)})' for i in range(1, ACCESS_COUNT + 1)
+        ) + ')')
+        for _ in range(ACCESS_COUNT):
+            params.append(station)
+            if walk_max is not None:
+                params.append(walk_max)
+    where = ' AND '.join(conditions) if conditions else '1'
+    return where, params
+
+# 条件に合う物件だけをSQLiteから取得する関数
+# areas・layoutsは空リストなら0件、Noneなら条件なしとして扱う
+# nearは（緯度, 経度, 半径m）で、範囲内の物件に絞り「距離(m)」の列を加える
+def query_properties(db_path, table_name, areas=None, layouts=None, price_min=None, price_max=None,
+                     bbox=None, near=None, station=None, walk_max=None):
+    ensure_schema(db_path, table_name)
+    if near is not None:
+        bbox = radius_bbox(*near)
+    where, params = build_where_clause(areas, layouts, price_min, price_max, bbox, station, walk_max, table_name)
+    with span('sqlite_query'):
+        conn = sqlite3.connect(db_path)
+        query = f'SELECT * FROM {table_name} WHERE {where} AND "家賃" IS NOT NULL'
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+    # SQLiteから読み込んだ行数（半径の絞り込みは読み込んだ後に行う）
+    count('rows_scanned', len(df))
+    if near is not None:
+        df['距離(m)'] = haversine_m(near[0], near[1], df['緯度'], df['経度'])
+        df = df[df['距離(m)'] <= near[2]]
+    count('rows_returned', len(df))
+    return df
+
+# 共有ストアを破棄する関数（スキーマの準備もやり直す）
+def clear_store():
+    with _store_lock:
+        _store.clear()
+    with _prepared_lock:
+        _prepared.clear()
@@ -0,0 +1,187 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from property_store import ensure_schema
+
+# ユーザー情報・お気に入りを保存するDB
+USER_DB_PATH = 'password.db'
+# 物件情報のDB（お気に入りとJOINするためにcatalogとしてATTACHする）
+PROPERTIES_DB_PATH = 'chintai.db'
+PROPERTIES_TABLE = 'properties'
+# プールに保持する接続数
+POOL_SIZE = 8
+
+# SQLite接続のプール（プロセス内で共有し、接続のたびにconnectしない）
+# 物件DBのバージョンが変わったら（取り込み・置き換え）、古いファイルをATTACHしたままの接続は使わずに作り直す
+class ConnectionPool:
+    def __init__(self, db_path, properties_db=None, table_name=PROPERTIES_TABLE, size=POOL_SIZE):
+        self.db_path = db_path
+        self.properties_db = properties_db
+        self.table_name = table_name
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._properties_version = None
+        self._generation = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        if self.properties_db:
+            conn.execute('ATTACH DATABASE ? AS catalog', (self.properties_db,))
+        return conn
+
+    # 物件DBのスキーマ（物件ID）を準備し、バージョンが変わっていればプールの接続を捨てる関数
+    def _refresh(self):
+        if not self.properties_db:
+            return
+        version = ensure_schema(self.properties_db, self.table_name)
+        if version == self._properties_version:
+            return
+        with self._lock:
+            if version != self._properties_version:
+                self._properties_version = version
+                self._generation += 1
+                self.close()
+
+    # 接続を借りて、終了時にコミット（例外時はロールバック）してプールに返す
+    @contextmanager
+    def connection(self):
+        self._refresh()
+        try:
+            conn, generation = self._idle.get_nowait()
+        except queue.Empty:
+            conn, generation = self._connect(), self._generation
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            # 借りている間に物件DBが変わった接続はプールに戻さない
+            if generation != self._generation:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait((conn, generation))
+                except queue.Full:
+                    conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait()[0].close()
+            except queue.Empty:
+                break
+
+# スキーマの移行処理（PRAGMA user_versionで適用済みの番号を管理する）
+def _migration_create_tables(conn, table_name):
+    conn.execute('CREATE TABLE IF NOT EXISTS userstable(username TEXT, password TEXT)')
+    conn.execute('CREATE TABLE IF NOT EXISTS favorite_properties(username TEXT, property_id TEXT)')
+
+# 旧形式（DataFrameの行番号を整数で保存）のお気に入りを物件IDに移行する
+def _migration_favorite_property_ids(conn, table_name):
+    column_types = {row[1]: row[2] for row in conn.execute('PRAGMA table_info(favorite_properties)')}
+    if column_types.get('property_id') != 'INTEGER':
+        return
+    conn.execute('CREATE TABLE favorite_properties_new(username TEXT, property_id TEXT)')
+    conn.execute(f"""
+        INSERT INTO favorite_properties_new(username, property_id)
+        SELECT f.username, p."物件ID"
+        FROM favorite_properties f JOIN catalog.{table_name} p ON p.rowid = f.property_id + 1
+    """)
+    conn.execute('DROP TABLE favorite_properties')
+    conn.execute('ALTER TABLE favorite_properties_new RENAME TO favorite_properties')
+
+# 重複行を削除してからUNIQUE制約を作成する
+def _migration_unique_indexes(conn, table_name):
+    conn.execute('DELETE FROM userstable WHERE rowid NOT IN (SELECT MIN(rowid) FROM userstable GROUP BY username)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_userstable_username ON userstable(username)')
+    conn.execute('DELETE FROM favorite_properties WHERE rowid NOT IN (SELECT MIN(rowid) FROM favorite_properties GROUP BY username, property_id)')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_favorite_properties_user_property ON favorite_properties(username, property_id)')
+
+MIGRATIONS = [
+    _migration_create_tables,
+    _migration_favorite_property_ids,
+    _migration_unique_indexes,
+]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# 起動時に一度だけ接続プールを作成し、スキーマを移行する関数
+def init_repository(db_path=USER_DB_PATH, properties_db=PROPERTIES_DB_PATH, table_name=PROPERTIES_TABLE):
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+        pool = ConnectionPool(db_path, properties_db, table_name)
+        with pool.connection() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(conn, table_name)
+                conn.execute(f'PRAGMA user_version = {number}')
+        _pool = pool
+        return _pool
+
+def get_pool():
+    return _pool if _pool is not None else init_repository()
+
+# ユーザーを追加する関数（ユーザー名が既に使われていればFalseを返す）
+def add_user(username, password):
+    try:
+        with get_pool().connection() as conn:
+            conn.execute('INSERT INTO userstable(username, password) VALUES (?, ?)', (username, password))
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+def login_user(username, password):
+    with get_pool().connection() as conn:
+        return conn.execute('SELECT * FROM userstable WHERE username = ? AND password = ?', (username, password)).fetchall()
+
+# お気に入り物件をまとめて保存する関数（登録済みの物件は無視し、追加した件数を返す）
+def add_favorite_properties(username, property_ids):
+    with get_pool().connection() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            'INSERT OR IGNORE INTO favorite_properties(username, property_id) VALUES (?, ?)',
+            [(username, property_id) for property_id in property_ids]
+        )
+        return conn.total_changes - before
+
+# お気に入り物件をまとめて削除する関数（削除した件数を返す）
+def remove_favorite_properties(username, property_ids):
+    with get_pool().connection() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            'DELETE FROM favorite_properties WHERE username = ? AND property_id = ?',
+            [(username, property_id) for property_id in property_ids]
+        )
+        return conn.total_changes - before
+
+def save_favorite_property(username, property_id):
+    return add_favorite_properties(username, [property_id])
+
+def remove_favorite_property(username, property_id):
+    return remove_favorite_properties(username, [property_id])
+
+# お気に入り物件のIDを取得する関数
+def get_favorite_properties(username):
+    with get_pool().connection() as conn:
+        rows = conn.execute('SELECT property_id FROM favorite_properties WHERE username = ?', (username,)).fetchall()
+    return [row[0] for row in rows]
+
+# お気に入り物件の物件情報を取得する関数（物件IDのインデックスを使った1回のJOINで取得する）
+def get_favorite_property_details(username, table_name=PROPERTIES_TABLE):
+    query = f"""
+        SELECT p."物件ID", p."名称", p."アドレス", p."家賃", p."間取り"
+        FROM favorite_properties f JOIN catalog.{table_name} p ON p."物件ID" = f.property_id
+        WHERE f.username = ?
+    """
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn, params=(username,))
@@ -0,0 +1,133 @@
+from urllib.parse import urlparse
+from scrape_state import make_listing_key
+
+# 同じ部屋かどうかの判定に使う許容差（差がこの値になると、その項目の一致度が0になる）
+# 築年数はサイトによって数え方（切り上げ・切り捨て）が違うため、1年の差は一致度0.5とする
+# 家賃は必須の条件で、許容差を超える物件は他の項目が一致しても別の部屋とみなす
+TOLERANCES = {
+    '面積': 1.0,    # m2
+    '築年数': 2,    # 年
+    '家賃': 0.03,   # 割合
+}
+# 各項目の重み（合計1）
+WEIGHTS = {'面積': 0.4, '階数': 0.3, '築年数': 0.15, '家賃': 0.15}
+# この値以上を同じ部屋とみなす
+MATCH_THRESHOLD = 0.85
+# 家賃の帯の幅（万円）。隣の帯も候補にするため、帯の境目にある物件も比べられる
+RENT_BAND = 1.0
+
+def _closeness(a, b, tolerance):
+    if a is None or b is None:
+        return 0.0
+    return max(0.0, 1.0 - abs(a - b) / tolerance) if tolerance else float(a == b)
+
+# 2件の物件の類似度（0〜1）を求める関数。間取りが違う場合と家賃が許容差を超える場合は0
+def match_score(a, b):
+    if a.get('間取り') and b.get('間取り') and a['間取り'] != b['間取り']:
+        return 0.0
+    rent_tolerance = TOLERANCES['家賃'] * max(a.get('家賃') or 0, b.get('家賃') or 0)
+    if a.get('家賃') is None or b.get('家賃') is None or abs(a['家賃'] - b['家賃']) > rent_tolerance:
+        return 0.0
+    return (
+        WEIGHTS['面積'] * _closeness(a.get('面積'), b.get('面積'), TOLERANCES['面積'])
+        + WEIGHTS['階数'] * _closeness(a.get('階数'), b.get('階数'), 0)
+        + WEIGHTS['築年数'] * _closeness(a.get('築年数'), b.get('築年数'), TOLERANCES['築年数'])
+        + WEIGHTS['家賃'] * _closeness(a.get('家賃'), b.get('家賃'), rent_tolerance)
+    )
+
+def _site(record):
+    return urlparse(record.get('掲載ページ') or record.get('物件詳細URL') or '').netloc
+
+# サイトをまたいだ重複物件を見つけるクラス
+# 丁目単位の住所と家賃の帯でブロックを作り、同じブロック（と隣の帯）の物件とだけ比べるため、
+# 比較回数は物件数にほぼ比例する。今回の実行分はSQLiteの一時テーブル、過去分は物件テーブルから候補を探す
+class EntityResolver:
+    COMPARE_COLUMNS = ['家賃', '面積', '階数', '築年数', '間取り']
+
+    def __init__(self, conn, table_name='properties', seen_at=None, rent_band=RENT_BAND, threshold=MATCH_THRESHOLD):
+        self.conn = conn
+        self.table_name = table_name
+        self.seen_at = seen_at
+        self.rent_band = rent_band
+        self.threshold = threshold
+        self.stats = {'comparisons': 0, 'duplicates': 0, 'cross_site': 0, 'same_site': 0, 'matched_existing': 0}
+        self.conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS er_listings(
+                block TEXT, 物件キー TEXT, site TEXT, 家賃 REAL, 面積 REAL, 階数 INTEGER, 築年数 INTEGER, 間取り TEXT,
+                duplicates INTEGER DEFAULT 0
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS temp.idx_er_listings_block ON er_listings(block)')
+        self.conn.execute('DELETE FROM er_listings')
+
+    def _band(self, rent):
+        return int(rent // self.rent_band)
+
+    def _candidates(self, address, rent):
+        band = self._band(rent)
+        blocks = [f'{address}|{b}' for b in (band - 1, band, band + 1)]
+        columns = ', '.join(self.COMPARE_COLUMNS)
+        rows = self.conn.execute(
+            f'SELECT rowid, site, {columns} FROM er_listings WHERE block IN (?, ?, ?)', blocks
+        ).fetchall()
+        return [(row[0], row[1], dict(zip(self.COMPARE_COLUMNS, row[2:]))) for row in rows]
+
+    def _existing_candidates(self, address, rent, own_key):
+        columns = ', '.join(f'"{col}"' for col in self.COMPARE_COLUMNS)
+        low, high = (self._band(rent) - 1) * self.rent_band, (self._band(rent) + 2) * self.rent_band
+        rows = self.conn.execute(
+            f'SELECT "物件キー", "掲載ページ", {columns} FROM {self.table_name} '
+            f'WHERE "アドレス" = ? AND "家賃" >= ? AND "家賃" < ? AND "掲載終了" IS NULL AND "物件キー" != ?',
+            (address, low, high, own_key)
+        ).fetchall()
+        return [(row[0], urlparse(row[1] or '').netloc, dict(zip(self.COMPARE_COLUMNS, row[2:]))) for row in rows]
+
+    def _best_match(self, record, candidates):
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            self.stats['comparisons'] += 1
+            score = match_score(record, candidate[2])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _count_duplicate(self, record, site):
+        self.stats['duplicates'] += 1
+        self.stats['cross_site' if site != _site(record) else 'same_site'] += 1
+
+    # 既に出てきた物件の重複ならTrueを返す（新しい物件ならブロックに登録してFalseを返す）
+    def is_duplicate(self, record):
+        address, rent = record.get('アドレス'), record.get('家賃')
+        if not address or rent is None:
+            return False
+        match = self._best_match(record, self._candidates(address, rent))
+        if match:
+            self._count_duplicate(record, match[1])
+            self.conn.execute('UPDATE er_listings SET duplicates = duplicates + 1 WHERE rowid = ?', (match[0],))
+            return True
+        own_key = make_listing_key(record)
+        match = self._best_match(record, self._existing_candidates(address, rent, own_key))
+        if match:
+            # 過去に登録済みの物件の重複は、登録済みの物件を今回も掲載中として扱う
+            self._count_duplicate(record, match[1])
+            self.stats['matched_existing'] += 1
+            if self.seen_at:
+                self.conn.execute(f'UPDATE {self.table_name} SET last_seen = ? WHERE "物件キー" = ?', (self.seen_at, match[0]))
+            return True
+        self.conn.execute(
+            'INSERT INTO er_listings(block, 物件キー, site, 家賃, 面積, 階数, 築年数, 間取り) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (f'{address}|{self._band(rent)}', own_key, _site(record), rent,
+             record.get('面積'), record.get('階数'), record.get('築年数'), record.get('間取り'))
+        )
+        return False
+
+    # 重複クラスタの統計（クラスタ数・最大サイズ・サイズごとの数など）
+    def report(self):
+        clusters = dict(self.conn.execute(
+            'SELECT duplicates + 1, COUNT(*) FROM er_listings WHERE duplicates > 0 GROUP BY duplicates'
+        ).fetchall())
+        report = dict(self.stats)
+        report['clusters'] = sum(clusters.values())
+        report['max_cluster_size'] = max(clusters) if clusters else 0
+        report['cluster_sizes'] = clusters
+        return report
@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streaming import bounded_map
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# ホストごとの同時接続数とリクエスト間隔を制限するクラス
+class HostLimiter:
+    def __init__(self, max_concurrency, min_interval):
+        self.min_interval = min_interval
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        # 前のリクエストの開始からmin_interval秒空くまで待つ
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+# 接続を再利用しながら複数のページを並行して取得するクラス
+# スレッドごとにSessionを持ち、keep-aliveの接続プール・タイムアウト・リトライ（指数バックオフ）を設定する
+class Fetcher:
+    def __init__(self, max_workers=8, per_host_concurrency=2, per_host_interval=1.0,
+                 timeout=(5, 30), retries=3, backoff_factor=1.0, headers=None):
+        self.max_workers = max_workers
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_interval = per_host_interval
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.headers = headers or DEFAULT_HEADERS
+        self._local = threading.local()
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            retry = Retry(
+                total=self.retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=['GET', 'HEAD'],
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=self.per_host_concurrency)
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = HostLimiter(self.per_host_concurrency, self.per_host_interval)
+            return self._limiters[host]
+
+    # 1ページ取得する関数（リトライしても失敗した場合はNoneを返す）
+    def fetch(self, url, headers=None):
+        with self._limiter(url):
+            try:
+                response = self._session().get(url, headers=headers, timeout=self.timeout)
+                response.raise_for_status()
+                return response
+            except requests.RequestException as e:
+                print(f"Failed to fetch {url}: {e}")
+                return None
+
+    # 複数ページを並行して取得し、(url, response)をurlsの順番で返すジェネレータ
+    # headers_forを渡すとURLごとに追加のヘッダー（条件付きリクエスト用など）を付ける
+    def fetch_all(self, urls, headers_for=None):
+        def fetch_one(url):
+            return self.fetch(url, headers_for(url) if headers_for else None)
+        def fetch_pair(url):
+            return url, fetch_one(url)
+        # 取得済みで未処理のレスポンスが溜まりすぎないよう、実行中のリクエスト数を制限する
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yield from bounded_map(executor, fetch_pair, urls, self.max_workers * 2)
@@ -0,0 +1,147 @@
+import csv
+import time
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderQueryError, GeocoderTimedOut, GeocoderServiceError
+from normalize import standardize_address
+from data_version import bump_data_version
+from scrape_state import now_iso
+from streaming import batched
+
+# バックエンドに一時的に問い合わせられない時の例外（タイムアウト・障害・回数制限など）
+# 見つからなかった住所と違い、キャッシュせずに次回問い合わせ直す
+class GeocodingUnavailable(Exception):
+    pass
+
+# Nominatimを使うバックエンド（利用規約により1秒に1回まで）
+class NominatimBackend:
+    min_interval = 1.0
+
+    def __init__(self, user_agent='orie_suzuyu_scraper', timeout=10, retries=2):
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+        self.retries = retries
+
+    # 見つからなければNoneを返し、問い合わせに失敗した時はGeocodingUnavailableを投げる
+    def lookup(self, address):
+        for attempt in range(self.retries + 1):
+            try:
+                location = self.geolocator.geocode(address)
+                return (location.latitude, location.longitude) if location else None
+            except GeocoderTimedOut:
+                time.sleep(2 ** attempt)
+            except GeocoderQueryError as e:
+                # 住所として解釈できないものは見つからなかった住所と同じに扱う
+                print(f"Geocoding failed for {address}: {e}")
+                return None
+            except GeocoderServiceError as e:
+                raise GeocodingUnavailable(str(e)) from e
+        raise GeocodingUnavailable(f"timed out after {self.retries + 1} attempts")
+
+# 住所と座標の対応表を使うオフラインのバックエンド（テストやNominatimを使えない環境向け）
+# CSVは「アドレス,緯度,経度」の3列
+class GazetteerBackend:
+    min_interval = 0.0
+
+    def __init__(self, mapping=None):
+        self.mapping = dict(mapping or {})
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls({row[0]: (float(row[1]), float(row[2])) for row in csv.reader(f) if len(row) >= 3 and row[0] != 'アドレス'})
+
+    def lookup(self, address):
+        return self.mapping.get(address)
+
+# 住所から座標を求めるクラス
+# 結果（見つからなかった住所も含む）はSQLiteにキャッシュし、キャッシュにない住所だけをバックエンドに問い合わせる
+# バックエンドに問い合わせられなかった住所はキャッシュせず、次回の実行のbackfillで問い合わせ直す
+class Geocoder:
+    def __init__(self, conn, backend):
+        self.conn = conn
+        self.backend = backend
+        self.lookups = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self._last_lookup = 0.0
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS geocode_cache(
+                address TEXT PRIMARY KEY, 緯度 REAL, 経度 REAL, geocoded_at TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def _lookup(self, address):
+        # バックエンドの間隔制限を守る
+        wait = self._last_lookup + self.backend.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_lookup = time.monotonic()
+        self.lookups += 1
+        return self.backend.lookup(address)
+
+    # 複数の住所をまとめて座標に変換する関数（住所 -> (緯度, 経度)、見つからなければNone）
+    def geocode_batch(self, addresses):
+        unique = list(dict.fromkeys(address for address in addresses if address))
+        results = {}
+        for chunk in batched(unique, 500):
+            placeholders = ', '.join('?' for _ in chunk)
+            for address, lat, lon in self.conn.execute(
+                f'SELECT address, 緯度, 経度 FROM geocode_cache WHERE address IN ({placeholders})', chunk
+            ):
+                results[address] = (lat, lon) if lat is not None else None
+        self.cache_hits += len(results)
+
+        missing = [address for address in unique if address not in results]
+        rows = []
+        for i, address in enumerate(missing):
+            try:
+                location = self._lookup(address)
+            except GeocodingUnavailable as e:
+                # 障害中に残りの住所を問い合わせても失敗するため、このバッチの残りは次回に回す
+                print(f"Geocoding unavailable, skipping {len(missing) - i} addresses: {e}")
+                self.failures += len(missing) - i
+                results.update((rest, None) for rest in missing[i:])
+                break
+            results[address] = location
+            rows.append((address, location[0] if location else None, location[1] if location else None, now_iso()))
+        if rows:
+            self.conn.executemany('INSERT OR REPLACE INTO geocode_cache(address, 緯度, 経度, geocoded_at) VALUES (?, ?, ?, ?)', rows)
+            self.conn.commit()
+        return results
+
+    # 座標のない掲載中の物件に座標を付け、付けた件数を返す関数
+    # 障害で後回しにした住所の物件は、ページが変わらない限り解析し直されないため、物件テーブルから直接探す
+    # （見つからなかった住所はキャッシュから返るため、問い合わせ直さない）
+    # has_timeを渡すと、Falseを返した時点で残りを次回に回す
+    def backfill(self, table_name, has_time=None, batch_size=50):
+        addresses = [row[0] for row in self.conn.execute(
+            f'SELECT DISTINCT "アドレス" FROM {table_name} WHERE "緯度" IS NULL AND "アドレス" IS NOT NULL AND "掲載終了" IS NULL'
+        )]
+        filled = 0
+        for chunk in batched(addresses, batch_size):
+            if has_time is not None and not has_time():
+                break
+            locations = self.geocode_batch([standardize_address(address) for address in chunk])
+            rows = [
+                (location[0], location[1], address)
+                for address in chunk for location in [locations.get(standardize_address(address))] if location
+            ]
+            before = self.conn.total_changes
+            self.conn.executemany(
+                f'UPDATE {table_name} SET "緯度" = ?, "経度" = ? WHERE "アドレス" = ? AND "緯度" IS NULL AND "掲載終了" IS NULL', rows
+            )
+            filled += self.conn.total_changes - before
+            if rows:
+                bump_data_version(self.conn)
+            self.conn.commit()
+        return filled
+
+# 環境変数からバックエンドを作る関数
+# GEOCODER=nominatim（既定）/ gazetteer（GAZETTEER_PATHのCSVを使う）/ none（ジオコーディングしない）
+def backend_from_env(environ):
+    name = environ.get('GEOCODER', 'nominatim')
+    if name == 'none':
+        return None
+    if name == 'gazetteer':
+        return GazetteerBackend.from_csv(environ['GAZETTEER_PATH'])
+    return NominatimBackend()
@@ -0,0 +1,114 @@
+import re
+import pandas as pd
+from access import ASCII_DIGITS, split_access
+
+# 半角数字を全角に変換する表（住所の丁目表記をchintai.dbに揃える）
+FULLWIDTH_DIGITS = str.maketrans('0123456789', '０１２３４５６７８９')
+
+# 整数で保存する列
+INTEGER_COLUMNS = ['築年数', '構造', '階数']
+# 敷金・礼金が0円を表す表記
+ZERO_VALUES = ['-', '無', 'なし', '0']
+
+# アドレスの標準化と処理（数字を全角にし、「丁目」または「-」以降を削除する）
+def standardize_address(address):
+    return re.sub(r'(丁目|-).*', '', address.translate(FULLWIDTH_DIGITS))
+
+# standardize_addressを列単位で行う関数
+def standardize_addresses(addresses):
+    return addresses.str.translate(FULLWIDTH_DIGITS).str.replace(r'(丁目|-).*', '', regex=True)
+
+def _ascii(values):
+    return values.astype(object).where(values.notna()).str.translate(ASCII_DIGITS).str.replace(',', '', regex=False)
+
+def _number(values, pattern):
+    return pd.to_numeric(values.str.extract(pattern, expand=False), errors='coerce')
+
+# 「12.5万円」「125000円」を万円単位の数値にする
+def parse_man_yen(values):
+    values = _ascii(values)
+    return _number(values, r'([\d.]+)\s*万').fillna(_number(values, r'^\s*([\d.]+)\s*円') / 10000)
+
+# 「18000円」「1.8万円」を円単位の数値にする（「-」は0円）
+def parse_yen(values):
+    values = _ascii(values)
+    yen = (_number(values, r'([\d.]+)\s*万') * 10000).fillna(_number(values, r'^\s*([\d.]+)\s*円?\s*$'))
+    return yen.mask(values.str.strip().isin(ZERO_VALUES), 0.0)
+
+# 敷金・礼金を万円単位の数値にする（「1ヶ月」は家賃の1か月分、「-」「無」は0）
+def parse_deposit(values, rent):
+    values = _ascii(values)
+    months = _number(values, r'([\d.]+)\s*[ヶケかカヵ]月') * rent
+    return parse_man_yen(values).fillna(months).mask(values.str.strip().isin(ZERO_VALUES), 0.0)
+
+# 「25.3m2」「25.3m²」を数値にする
+def parse_area(values):
+    return _number(_ascii(values), r'([\d.]+)\s*m')
+
+# 「新築」は0年、「築22年」「3年」は年数にする
+def parse_age(values):
+    values = _ascii(values)
+    return _number(values, r'(\d+)\s*年').mask(values.str.contains('新築', na=False), 0)
+
+# 「12階建」「地下2地上43階建」を地上階数にする
+def parse_structure(values):
+    return _number(_ascii(values), r'(\d+)\s*階建')
+
+# 「12階」「1-2階」を階数にする（「B1階」は-1）
+def parse_floor(values):
+    values = _ascii(values)
+    floor = _number(values, r'(\d+)')
+    return floor.mask(values.str.match(r'^\s*B', na=False), -floor)
+
+# アドレスから区と市町（丁目の数字を除いた町名）を取り出す
+def split_ward(addresses):
+    parts = addresses.str.extract(r'^東京都(?P<区>[^区]+区)(?P<市町>[^0-9０-９]*)')
+    parts['市町'] = parts['市町'].mask(parts['市町'] == '')
+    return parts
+
+def _replace_columns(df, columns):
+    return df.drop(columns=[col for col in columns.columns if col in df.columns]).join(columns)
+
+# スクレイピング結果の表を正規化する関数（列単位で処理し、行ごとのループは使わない）
+# 数値の列はchintai.dbと同じ単位の数値になり、区・市町・アクセスの列が加わる
+def normalize_frame(df):
+    df = df.copy()
+    if 'アドレス' in df.columns:
+        df['アドレス'] = standardize_addresses(df['アドレス'].astype(object))
+        df = _replace_columns(df, split_ward(df['アドレス']))
+    if 'アクセス' in df.columns:
+        df = _replace_columns(df, split_access(df['アクセス']))
+    if '家賃' in df.columns:
+        rent = parse_man_yen(df['家賃'])
+        for col in ['敷金', '礼金']:
+            if col in df.columns:
+                df[col] = parse_deposit(df[col], rent)
+        df['家賃'] = rent
+    if '管理費' in df.columns:
+        df['管理費'] = parse_yen(df['管理費'])
+    if '面積' in df.columns:
+        df['面積'] = parse_area(df['面積'])
+    if '築年数' in df.columns:
+        df['築年数'] = parse_age(df['築年数'])
+    if '構造' in df.columns:
+        df['構造'] = parse_structure(df['構造'])
+    if '階数' in df.columns:
+        df['階数'] = parse_floor(df['階数'])
+    return df
+
+# 表をSQLiteに書き込める値（None・int・float・str）の辞書のリストに変換する関数
+def frame_to_records(df):
+    columns = {}
+    for col in df.columns:
+        values = df[col].tolist()
+        if col in INTEGER_COLUMNS:
+            columns[col] = [None if pd.isna(value) else int(value) for value in values]
+        else:
+            columns[col] = [None if pd.isna(value) else value for value in values]
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+# 辞書のリストを正規化する関数
+def normalize_records(records):
+    if not records:
+        return []
+    return frame_to_records(normalize_frame(pd.DataFrame(records)))
@@ -0,0 +1,178 @@
+import time
+from market_stats import refresh_market_stats
+from pipeline import PipelineStats, run_pipeline
+from scrape_state import now_iso
+from sites import WARDS, count_pages, page_url, page_url_prefix
+
+# ジョブの種類（discover：1ページ目から総ページ数を調べる、page：一覧ページを取得して取り込む）
+DISCOVER = 'discover'
+PAGE = 'page'
+
+# SQLiteに保存するジョブキュー
+# 実行（run）ごとにジョブを登録し、処理済みの状態を保存するため、途中で止まっても次回は続きから再開できる
+class JobQueue:
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scrape_runs(
+                run_id INTEGER PRIMARY KEY, started_at TEXT, finished_at TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scrape_jobs(
+                run_id INTEGER, kind TEXT, url TEXT, site TEXT, ward TEXT, page INTEGER,
+                status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, updated_at TEXT,
+                PRIMARY KEY(run_id, kind, url)
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_scrape_jobs_status ON scrape_jobs(run_id, kind, status)')
+        self.conn.commit()
+
+    # 終わっていない実行を返す関数（なければNone）
+    def current_run(self):
+        return self.conn.execute(
+            'SELECT run_id, started_at FROM scrape_runs WHERE finished_at IS NULL ORDER BY run_id DESC LIMIT 1'
+        ).fetchone()
+
+    def start_run(self, started_at):
+        cursor = self.conn.execute('INSERT INTO scrape_runs(started_at) VALUES (?)', (started_at,))
+        self.conn.commit()
+        return cursor.lastrowid, started_at
+
+    # 実行を完了にし、そのジョブを削除する関数（DBをコミットし続けるため、終わったジョブは残さない）
+    def finish_run(self, run_id):
+        self.conn.execute('UPDATE scrape_runs SET finished_at = ? WHERE run_id = ?', (now_iso(), run_id))
+        self.conn.execute('DELETE FROM scrape_jobs WHERE run_id = ?', (run_id,))
+        self.conn.commit()
+
+    # ジョブを登録する関数（jobsは(kind, url, site, ward, page)。登録済みのジョブは無視する）
+    def enqueue(self, run_id, jobs):
+        self.conn.executemany(
+            'INSERT OR IGNORE INTO scrape_jobs(run_id, kind, url, site, ward, page, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(run_id, *job, now_iso()) for job in jobs]
+        )
+        self.conn.commit()
+
+    # 前回処理中のまま止まったジョブを未処理に戻す関数
+    def requeue_running(self, run_id):
+        self.conn.execute("UPDATE scrape_jobs SET status = 'pending' WHERE run_id = ? AND status = 'running'", (run_id,))
+        self.conn.commit()
+
+    # 未処理のジョブをlimit件取り出して処理中にする関数
+    # ページ番号順に取り出し、1つのチャンクに全サイト・全区のページが混ざるようにする（サイトごとの間隔制限で待たないため）
+    def claim(self, run_id, kind, limit):
+        rows = self.conn.execute(
+            "SELECT url, site, ward, page FROM scrape_jobs WHERE run_id = ? AND kind = ? AND status = 'pending' "
+            'ORDER BY page, site, ward LIMIT ?',
+            (run_id, kind, limit)
+        ).fetchall()
+        self.conn.executemany(
+            "UPDATE scrape_jobs SET status = 'running', updated_at = ? WHERE run_id = ? AND kind = ? AND url = ?",
+            [(now_iso(), run_id, kind, row[0]) for row in rows]
+        )
+        self.conn.commit()
+        return rows
+
+    def complete(self, run_id, kind, urls):
+        self.conn.executemany(
+            "UPDATE scrape_jobs SET status = 'done', updated_at = ? WHERE run_id = ? AND kind = ? AND url = ?",
+            [(now_iso(), run_id, kind, url) for url in urls]
+        )
+        self.conn.commit()
+
+    # 失敗したジョブはmax_attempts回までは未処理に戻し、それを超えたら失敗にする
+    def fail(self, run_id, kind, urls, max_attempts=3):
+        self.conn.executemany("""
+            UPDATE scrape_jobs SET
+                attempts = attempts + 1,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                updated_at = ?
+            WHERE run_id = ? AND kind = ? AND url = ?
+        """, [(max_attempts, now_iso(), run_id, kind, url) for url in urls])
+        self.conn.commit()
+
+    # 実行の対象（サイトと区の組）。再開した実行でも、環境変数ではなく開始時の指定を使う
+    def scope(self, run_id):
+        return self.conn.execute(
+            'SELECT DISTINCT site, ward FROM scrape_jobs WHERE run_id = ? AND kind = ? ORDER BY site, ward', (run_id, DISCOVER)
+        ).fetchall()
+
+    # 状態ごとのジョブ数
+    def counts(self, run_id):
+        return dict(self.conn.execute(
+            'SELECT status, COUNT(*) FROM scrape_jobs WHERE run_id = ? GROUP BY status', (run_id,)
+        ).fetchall())
+
+# 区・サイトごとの1ページ目を取得して総ページ数を調べ、ページのジョブを登録する
+def discover_pages(queue, run_id, fetcher, jobs, max_page=0, max_attempts=3):
+    found, failed = [], []
+    for (url, site, ward, _), (_, response) in zip(jobs, fetcher.fetch_all([job[0] for job in jobs])):
+        if response is None:
+            failed.append(url)
+            continue
+        pages = count_pages(response.content)
+        if max_page:
+            pages = min(pages, max_page)
+        queue.enqueue(run_id, [(PAGE, page_url(site, WARDS[ward], page), site, ward, page) for page in range(1, pages + 1)])
+        found.append(url)
+        print(f"{site} {ward}: {pages} pages")
+    queue.complete(run_id, DISCOVER, found)
+    queue.fail(run_id, DISCOVER, failed, max_attempts)
+
+# 複数の区・サイトのスクレイピングをジョブキューで進める関数
+# ページのジョブをchunk_size件ずつパイプラインに流し、チャンクごとに進み具合を保存する
+# time_budget秒（0は無制限）を過ぎたら新しいチャンクを始めずに終わり、次回の実行で続きから再開する
+# 全ジョブが終わった時だけ実行を完了にし、失敗したページがなければ対象のサイト・区で見つからなかった物件を掲載終了にする
+def run_orchestrator(state, fetcher, sites, wards, max_page=0, time_budget=0, chunk_size=200, max_attempts=3,
+                     incremental=True, parse_workers=None, batch_size=500, geocoder=None):
+    deadline = time.monotonic() + time_budget if time_budget else None
+    queue = JobQueue(state.conn)
+    run = queue.current_run()
+    if run is None:
+        run = queue.start_run(now_iso())
+        queue.enqueue(run[0], [(DISCOVER, page_url(site, WARDS[ward], 1), site, ward, 1) for site in sites for ward in wards])
+    else:
+        print(f"Resuming run {run[0]} started at {run[1]}")
+        queue.requeue_running(run[0])
+    run_id, run_started = run
+
+    def has_time():
+        return deadline is None or time.monotonic() < deadline
+
+    while has_time():
+        jobs = queue.claim(run_id, DISCOVER, chunk_size)
+        if not jobs:
+            break
+        discover_pages(queue, run_id, fetcher, jobs, max_page, max_attempts)
+
+    stats = PipelineStats()
+    while has_time():
+        jobs = queue.claim(run_id, PAGE, chunk_size)
+        if not jobs:
+            break
+        failed_before = len(stats.failed_pages)
+        run_pipeline(
+            [(site, url) for url, site, _, _ in jobs], fetcher, state, run_started,
+            incremental=incremental, parse_workers=parse_workers, batch_size=batch_size, geocoder=geocoder, stats=stats,
+        )
+        failed = set(stats.failed_pages[failed_before:])
+        queue.complete(run_id, PAGE, [job[0] for job in jobs if job[0] not in failed])
+        queue.fail(run_id, PAGE, list(failed), max_attempts)
+
+    # 障害で座標を付けられなかった物件に、残りの時間で座標を付ける
+    if geocoder is not None and has_time():
+        print(f"Geocoding backfill: {geocoder.backfill(state.table_name, has_time)} listings")
+
+    counts = queue.counts(run_id)
+    finished = not counts.get('pending') and not counts.get('running')
+    if finished:
+        # 掲載終了にするのは今回の実行で取得したサイト・区の物件だけ（ジョブを削除する前に対象を求める）
+        if not counts.get('failed'):
+            scope = queue.scope(run_id)
+            prefixes = [page_url_prefix(site, WARDS[ward]) for site, ward in scope]
+            wards = sorted({ward for _, ward in scope})
+            print(f"Listings: {state.mark_delisted(run_started, prefixes, wards)} delisted")
+        queue.finish_run(run_id)
+    # 取り込んだ内容（掲載中の物件）で相場表を作り直す
+    refresh_market_stats(state.conn, state.table_name)
+    return stats, counts, finished
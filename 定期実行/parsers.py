@@ -0,0 +1,182 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import soupsieve as sv
+from bs4 import BeautifulSoup, SoupStrainer
+from scrape_state import ROOM_URL_FIELD
+from streaming import bounded_map
+
+def _text(element):
+    return element.get_text(strip=True) if element else None
+
+# 部屋の行に部屋ごとのリンクがあれば物件詳細URLにし、なければ建物のリンクのままにする
+# 建物のリンクの部屋は、物件キーに家賃も加えて同じ階・間取り・面積の部屋を区別する（scrape_state.make_listing_key）
+def _set_room_url(data, link, prefix=''):
+    data[ROOM_URL_FIELD] = link is not None
+    if link is not None:
+        data["物件詳細URL"] = prefix + link['href']
+
+# homesの一覧ページから部屋ごとのデータを取り出すクラス
+# 物件（建物）単位の要素は建物ごとに一度だけ取り出し、各部屋のデータにコピーする
+class HomesExtractor:
+    site = 'homes'
+    # 物件一覧のコンテナだけを解析する
+    strainer = SoupStrainer('div', class_='mod-mergeBuilding--rent--photo')
+
+    # 事前にコンパイルしたCSSセレクタ
+    BUKKEN_NAME = sv.compile('.bukkenName')
+    TRAFFIC = sv.compile('td.traffic')
+    STATION_TEXT = sv.compile('span.prg-stationText')
+    MODULE_BODY = sv.compile('div.moduleBody')
+    ROOMS = sv.compile('.unitListBody.prg-unitListBody')
+    ROOM_FLOOR = sv.compile('.roomKaisuu')
+    ROOM_RENT = sv.compile('span.priceLabel')
+    ROOM_PRICE = sv.compile('td.price')
+    ROOM_LAYOUT = sv.compile('td.layout')
+    PROPERTY_IMAGE = sv.compile('.bukkenPhoto .photo img')
+    FLOOR_PLAN_IMAGE = sv.compile('.floarPlanPic img')
+    PROPERTY_LINK = sv.compile("a[href*='/chintai/room']")
+
+    def parse(self, html, page_url):
+        soup = BeautifulSoup(html, 'lxml', parse_only=self.strainer)
+        records = []
+        for item in soup.find_all('div', class_='mod-mergeBuilding--rent--photo'):
+            records.extend(self.parse_item(item, page_url))
+        return records
+
+    def parse_item(self, item, page_url):
+        base_data = {"掲載ページ": page_url}
+        base_data["名称"] = _text(self.BUKKEN_NAME.select_one(item))
+        base_data["アドレス"] = None
+        for th in item.find_all('th'):
+            if th.get_text(strip=True) == '所在地':
+                base_data["アドレス"] = _text(th.find_next_sibling('td'))
+                break
+        traffic = self.TRAFFIC.select_one(item)
+        base_data["アクセス"] = _text(traffic) if traffic else ', '.join(span.get_text(strip=True) for span in self.STATION_TEXT.select(item))
+        module_body = self.MODULE_BODY.select_one(item)
+        if module_body:
+            construction_th = module_body.find('th', string='築年数/階数')
+            if construction_th:
+                construction = (_text(construction_th.find_next_sibling('td')) or '').split(' ')
+                base_data["築年数"] = construction[0]
+                base_data["構造"] = construction[2] if len(construction) > 2 else None
+
+        property_image_element = self.PROPERTY_IMAGE.select_one(item)
+        base_data["物件画像URL"] = property_image_element.get("data-original") if property_image_element else None
+        floor_plan_image_element = self.FLOOR_PLAN_IMAGE.select_one(item)
+        base_data["間取画像URL"] = floor_plan_image_element.get("data-original") if floor_plan_image_element else None
+        property_link_element = self.PROPERTY_LINK.select_one(item)
+        base_data["物件詳細URL"] = property_link_element['href'] if property_link_element else None
+
+        records = []
+        for room in self.ROOMS.select(item):
+            data = base_data.copy()
+            _set_room_url(data, self.PROPERTY_LINK.select_one(room))
+            # 当該部屋の階数
+            data["階数"] = _text(self.ROOM_FLOOR.select_one(room))
+
+            # 賃料と管理費を分けて取得
+            rent_price_label = self.ROOM_RENT.select_one(room)
+            data["家賃"] = _text(rent_price_label)
+            admin = rent_price_label.next_sibling if rent_price_label else None
+            data["管理費"] = str(admin).strip().replace("/", "").replace(",", "") if admin else None
+
+            # 敷金と礼金を分けて取得
+            price = self.ROOM_PRICE.select_one(room)
+            br = price.find('br') if price else None
+            deposit_key = str(br.next_sibling).strip() if br and br.next_sibling else ''
+            deposit_key = deposit_key.split("/")
+            depo, key = deposit_key if len(deposit_key) == 2 else (None, None)
+            data["敷金"] = depo
+            data["礼金"] = key
+
+            # 間取りと占有面積を分けて取得
+            layout = self.ROOM_LAYOUT.select_one(room)
+            data["間取り"] = str(layout.contents[0]).strip() if layout and layout.contents else None
+            br = layout.find('br') if layout else None
+            data["面積"] = str(br.next_sibling).strip().replace('m²', 'm2') if br and br.next_sibling else None
+
+            records.append(data)
+        return records
+
+# スーモの一覧ページから部屋ごとのデータを取り出すクラス
+class SuumoExtractor:
+    site = 'suumo'
+    strainer = SoupStrainer('div', class_='cassetteitem')
+
+    TITLE = sv.compile('div.cassetteitem_content-title')
+    LABEL = sv.compile('div.cassetteitem_content-label span')
+    ADDRESS = sv.compile('li.cassetteitem_detail-col1')
+    STATIONS = sv.compile('div.cassetteitem_detail-text')
+    CONSTRUCTION = sv.compile('li.cassetteitem_detail-col3 div')
+    ROOMS = sv.compile('table.cassetteitem_other tbody')
+    RENT = sv.compile('.cassetteitem_price--rent')
+    ADMINISTRATION = sv.compile('.cassetteitem_price--administration')
+    DEPOSIT = sv.compile('.cassetteitem_price--deposit')
+    GRATUITY = sv.compile('.cassetteitem_price--gratuity')
+    MADORI = sv.compile('.cassetteitem_madori')
+    MENSEKI = sv.compile('.cassetteitem_menseki')
+    PROPERTY_IMAGE = sv.compile('.cassetteitem_object-item img')
+    FLOOR_PLAN_IMAGE = sv.compile('.casssetteitem_other-thumbnail img')
+    PROPERTY_LINK = sv.compile("a[href*='/chintai/jnc_']")
+
+    def parse(self, html, page_url):
+        soup = BeautifulSoup(html, 'lxml', parse_only=self.strainer)
+        records = []
+        for item in soup.find_all('div', class_='cassetteitem'):
+            records.extend(self.parse_item(item, page_url))
+        return records
+
+    def parse_item(self, item, page_url):
+        base_data = {"掲載ページ": page_url}
+        base_data["名称"] = _text(self.TITLE.select_one(item))
+        base_data["カテゴリ"] = _text(self.LABEL.select_one(item))
+        base_data["アドレス"] = _text(self.ADDRESS.select_one(item))
+        base_data["アクセス"] = ", ".join(station.get_text(strip=True) for station in self.STATIONS.select(item))
+        construction_info = self.CONSTRUCTION.select(item)
+        base_data["築年数"] = _text(construction_info[0]) if len(construction_info) > 0 else None
+        base_data["構造"] = _text(construction_info[1]) if len(construction_info) > 1 else None
+
+        property_image_element = self.PROPERTY_IMAGE.select_one(item)
+        base_data["物件画像URL"] = property_image_element.get("rel") if property_image_element else None
+        floor_plan_image_element = self.FLOOR_PLAN_IMAGE.select_one(item)
+        base_data["間取画像URL"] = floor_plan_image_element.get("rel") if floor_plan_image_element else None
+        property_link_element = self.PROPERTY_LINK.select_one(item)
+        base_data["物件詳細URL"] = "https://suumo.jp" + property_link_element['href'] if property_link_element else None
+
+        records = []
+        for tbody in self.ROOMS.select(item):
+            data = base_data.copy()
+            _set_room_url(data, self.PROPERTY_LINK.select_one(tbody), "https://suumo.jp")
+            tds = tbody.find_all("td")
+            data["階数"] = tds[2].get_text(strip=True) if len(tds) > 2 else None
+            data["家賃"] = _text(self.RENT.select_one(tbody))
+            data["管理費"] = _text(self.ADMINISTRATION.select_one(tbody))
+            data["敷金"] = _text(self.DEPOSIT.select_one(tbody))
+            data["礼金"] = _text(self.GRATUITY.select_one(tbody))
+            data["間取り"] = _text(self.MADORI.select_one(tbody))
+            data["面積"] = _text(self.MENSEKI.select_one(tbody))
+            records.append(data)
+        return records
+
+EXTRACTORS = {
+    HomesExtractor.site: HomesExtractor(),
+    SuumoExtractor.site: SuumoExtractor(),
+}
+
+# 1ページ分を解析する関数（プロセスプールから呼ばれるためモジュールの関数にしている）
+def parse_page(job):
+    site, url, html = job
+    return EXTRACTORS[site].parse(html, url)
+
+# 複数ページをプロセスプールで並列に解析し、ページごとの部屋データのリストを入力順に返すジェネレータ
+# jobsは(site, url, html)の並び（ジェネレータでもよい）。解析待ちのページはwindow件までしか保持しない
+# max_workers=1の時はプロセスを作らずに解析する
+def parse_pages(jobs, max_workers=None, window=None):
+    if max_workers == 1:
+        for job in jobs:
+            yield parse_page(job)
+        return
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        yield from bounded_map(executor, parse_page, jobs, window or max_workers * 2)
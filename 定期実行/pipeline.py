@@ -0,0 +1,125 @@
+import pandas as pd
+from dedupe import EntityResolver
+from normalize import frame_to_records, normalize_frame, standardize_address
+from parsers import parse_pages
+from streaming import batched
+
+# 処理件数を数えるクラス
+class PipelineStats:
+    def __init__(self):
+        self.pages_changed = 0
+        self.pages_unchanged = 0
+        self.failed_pages = []
+        self.parsed = 0
+        self.duplicates = 0
+        self.listings = {'new': 0, 'changed': 0, 'unchanged': 0}
+        self.dedupe = {}
+
+    # 重複判定の統計を足し合わせる（チャンクに分けて実行した場合）
+    def add_dedupe(self, report):
+        for name, value in report.items():
+            if name == 'cluster_sizes':
+                sizes = self.dedupe.setdefault(name, {})
+                for size, count in value.items():
+                    sizes[size] = sizes.get(size, 0) + count
+            elif name == 'max_cluster_size':
+                self.dedupe[name] = max(self.dedupe.get(name, 0), value)
+            else:
+                self.dedupe[name] = self.dedupe.get(name, 0) + value
+
+    def summary(self):
+        text = (
+            f"Pages: {self.pages_changed} changed, {self.pages_unchanged} unchanged, {len(self.failed_pages)} failed\n"
+            f"Listings: {self.parsed} parsed, {self.duplicates} duplicates, "
+            f"{self.listings['new']} new, {self.listings['changed']} changed, {self.listings['unchanged']} unchanged"
+        )
+        if self.dedupe:
+            d = self.dedupe
+            sizes = ', '.join(f'{size}件x{count}' for size, count in sorted(d['cluster_sizes'].items()))
+            text += (
+                f"\nDuplicates: {d['cross_site']} cross-site, {d['same_site']} same-site, {d['matched_existing']} matched existing, "
+                f"{d['comparisons']} comparisons\n"
+                f"Clusters: {d['clusters']} (max size {d['max_cluster_size']}{'; ' + sizes if sizes else ''})"
+            )
+        return text
+
+# 取得段階：ページを取得し、変更のあるページだけを(site, url, html)で流すジェネレータ
+# 変更のないページは掲載中の物件のlast_seenだけを更新する
+def fetch_stage(site_urls, fetcher, state, run_started, stats, incremental=True, changed_pages=None):
+    urls = [url for _, url in site_urls]
+    sites = dict((url, site) for site, url in site_urls)
+    request_headers = {url: state.conditional_headers(url) for url in urls} if incremental else {}
+    for url, response in fetcher.fetch_all(urls, headers_for=request_headers.get):
+        if response is None:
+            stats.failed_pages.append(url)
+            continue
+        metadata = state.page_metadata(response)
+        if incremental and state.is_page_unchanged(url, metadata):
+            stats.pages_unchanged += 1
+            state.touch_page_listings(url, run_started)
+            state.record_page(url, metadata, run_started)
+            continue
+        stats.pages_changed += 1
+        # ページの記録は物件を書き込んだ後に行う（途中で止まった場合は次回も解析し直す）
+        if changed_pages is not None:
+            changed_pages.append((url, metadata))
+        yield sites[url], url, response.content
+
+# 解析段階：ページごとの部屋データを1件ずつ流すジェネレータ
+def parse_stage(pages, stats, max_workers=None):
+    for records in parse_pages(pages, max_workers=max_workers):
+        for record in records:
+            stats.parsed += 1
+            yield record
+
+# 正規化段階：batch_size件ずつ表にして列単位で正規化するジェネレータ
+def normalize_stage(records, batch_size=500):
+    for batch in batched(records, batch_size):
+        df = pd.DataFrame(batch).drop(columns=['カテゴリ'], errors='ignore')
+        yield from frame_to_records(normalize_frame(df))
+
+# 重複除去段階：正規化後の値でサイトをまたいだ同じ部屋を見つけ、最初に出てきた1件だけを流す
+def dedupe_stage(records, resolver, stats):
+    for record in records:
+        if resolver.is_duplicate(record):
+            stats.duplicates += 1
+        else:
+            yield record
+
+# ジオコーディング段階：batch_size件ずつ、丁目単位に標準化した住所の座標をまとめて求めるジェネレータ
+def geocode_stage(records, geocoder, batch_size=500):
+    for batch in batched(records, batch_size):
+        keys = [standardize_address(record['アドレス']) if record.get('アドレス') else None for record in batch]
+        locations = geocoder.geocode_batch(keys)
+        for record, key in zip(batch, keys):
+            location = locations.get(key) if key else None
+            if location:
+                record['緯度'], record['経度'] = location
+            yield record
+
+# 書き込み段階：batch_size件ずつトランザクションで追加・更新する
+def write_stage(records, state, run_started, stats, batch_size=500):
+    for batch in batched(records, batch_size):
+        result = state.upsert_listings(batch, run_started)
+        for name, count in result.items():
+            stats.listings[name] += count
+
+# 取得→解析→正規化→重複除去→書き込みを順に流すパイプライン
+# 各段階はジェネレータでつながっているため、メモリ使用量はページ数や物件数によらずほぼ一定になる
+# geocoderを渡すと、書き込み前に座標を付ける。statsを渡すと件数をそこに足していく
+def run_pipeline(site_urls, fetcher, state, run_started, incremental=True, parse_workers=None, batch_size=500, geocoder=None, stats=None):
+    stats = stats or PipelineStats()
+    changed_pages = []
+    pages = fetch_stage(site_urls, fetcher, state, run_started, stats, incremental, changed_pages)
+    records = parse_stage(pages, stats, parse_workers)
+    records = normalize_stage(records, batch_size)
+    resolver = EntityResolver(state.conn, state.table_name, run_started)
+    records = dedupe_stage(records, resolver, stats)
+    if geocoder is not None:
+        records = geocode_stage(records, geocoder, batch_size)
+    write_stage(records, state, run_started, stats, batch_size)
+    state.conn.commit()
+    stats.add_dedupe(resolver.report())
+    for url, metadata in changed_pages:
+        state.record_page(url, metadata, run_started)
+    return stats
@@ -0,0 +1,222 @@
+import hashlib
+import sqlite3
+from datetime import datetime, timezone
+from data_version import bump_data_version
+from property_store import PROPERTY_ID_FALLBACK_COLUMNS, PROPERTY_ID_SOURCE_COLUMNS, make_property_id
+
+# 物件テーブルに保存する列とその型（chintai.dbのpropertiesと同じ。数値は取り込み時に正規化する）
+COLUMN_TYPES = {
+    '名称': 'TEXT', 'アドレス': 'TEXT', 'アクセス': 'TEXT', '築年数': 'INTEGER', '構造': 'INTEGER',
+    '階数': 'INTEGER', '家賃': 'REAL', '管理費': 'REAL', '敷金': 'REAL', '礼金': 'REAL',
+    '間取り': 'TEXT', '面積': 'REAL', '物件画像URL': 'TEXT', '間取画像URL': 'TEXT', '物件詳細URL': 'TEXT',
+    '区': 'TEXT', '市町': 'TEXT',
+    'アクセス1徒歩(分)': 'REAL', 'アクセス1線路名': 'TEXT', 'アクセス1駅名': 'TEXT',
+    'アクセス2徒歩(分)': 'REAL', 'アクセス2線路名': 'TEXT', 'アクセス2駅名': 'TEXT',
+    'アクセス3徒歩(分)': 'REAL', 'アクセス3線路名': 'TEXT', 'アクセス3駅名': 'TEXT',
+}
+LISTING_COLUMNS = list(COLUMN_TYPES)
+# ジオコーディングで付ける座標の列（内容ハッシュには含めない）
+GEO_COLUMNS = ['緯度', '経度']
+# 変更を検出する列（物件を識別する列以外）
+LISTING_CONTENT_COLUMNS = [col for col in LISTING_COLUMNS if col not in PROPERTY_ID_SOURCE_COLUMNS]
+# 履歴管理用の列
+HISTORY_COLUMNS = ['物件キー', '掲載ページ', '内容ハッシュ', 'first_seen', 'last_seen', 'updated_at', '掲載終了']
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _hash_values(values):
+    key = '|'.join('' if value is None else str(value) for value in values)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+# 物件詳細URLが部屋ごとのリンクかどうかを表す項目（解析結果にだけ付け、テーブルには保存しない）
+ROOM_URL_FIELD = '部屋URL'
+
+# 物件キーを作成する関数（アプリの物件IDと同じ値になる）
+# 物件詳細URLが建物のリンクの部屋（部屋ごとのリンクがない時・旧テーブルの移行時）は家賃も加える
+def make_listing_key(listing):
+    columns = PROPERTY_ID_SOURCE_COLUMNS if listing.get(ROOM_URL_FIELD) else PROPERTY_ID_FALLBACK_COLUMNS
+    return make_property_id(listing.get(col) for col in columns)
+
+# 物件の内容のハッシュを作成する関数（家賃などが変わったかどうかの判定に使う）
+def make_content_hash(listing):
+    return _hash_values(listing.get(col) for col in LISTING_CONTENT_COLUMNS)
+
+# 差分スクレイピングの状態（ページのETag・Last-Modified・内容ハッシュと物件の掲載履歴）を管理するクラス
+class ScrapeState:
+    def __init__(self, db_path, table_name='properties'):
+        self.table_name = table_name
+        self.conn = sqlite3.connect(db_path)
+        self.ensure_schema()
+
+    def ensure_schema(self):
+        c = self.conn
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS pages(
+                url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, content_hash TEXT, fetched_at TEXT
+            )
+        """)
+        column_types = {row[1]: row[2] for row in c.execute(f'PRAGMA table_info({self.table_name})')}
+        if column_types.get('家賃') == 'TEXT':
+            # 文字列のまま保存していたテーブル（全件置き換え方式または正規化前の差分方式）を移行する
+            self._migrate_text_table(column_types)
+        elif not column_types:
+            self._create_table()
+        else:
+            for col in GEO_COLUMNS:
+                if col not in column_types:
+                    c.execute(f'ALTER TABLE {self.table_name} ADD COLUMN "{col}" REAL')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table_name}_page ON {self.table_name}("掲載ページ")')
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table_name}_last_seen ON {self.table_name}(last_seen)')
+        # 重複判定で住所と家賃の帯から候補を探すための索引
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table_name}_block ON {self.table_name}("アドレス", "家賃")')
+        c.commit()
+
+    # 旧テーブルの行を正規化し、型付きの新しいテーブルに入れ直す（取得日時の履歴は引き継ぐ）
+    def _migrate_text_table(self, column_types):
+        from normalize import normalize_records
+        c = self.conn
+        c.execute(f'ALTER TABLE {self.table_name} RENAME TO {self.table_name}_old')
+        self._create_table()
+        old_columns = [col for col in LISTING_COLUMNS + GEO_COLUMNS + ['掲載ページ', 'first_seen', 'last_seen', '掲載終了'] if col in column_types]
+        column_list = ', '.join(f'"{col}"' for col in old_columns)
+        cursor = c.execute(f'SELECT {column_list} FROM {self.table_name}_old')
+        migrated_at = now_iso()
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            self.upsert_listings(normalize_records([dict(zip(old_columns, row)) for row in rows]), migrated_at, commit=False)
+        c.execute(f'DROP TABLE {self.table_name}_old')
+
+    def _create_table(self):
+        column_defs = ', '.join(f'"{col}" {col_type}' for col, col_type in COLUMN_TYPES.items())
+        geo_defs = ', '.join(f'"{col}" REAL' for col in GEO_COLUMNS)
+        self.conn.execute(f"""
+            CREATE TABLE {self.table_name}(
+                {column_defs}, {geo_defs},
+                "物件キー" TEXT PRIMARY KEY, "掲載ページ" TEXT, "内容ハッシュ" TEXT,
+                first_seen TEXT, last_seen TEXT, updated_at TEXT, "掲載終了" TEXT
+            )
+        """)
+
+    # 前回取得時のETag・Last-Modifiedから条件付きリクエストのヘッダーを作る関数
+    def conditional_headers(self, url):
+        row = self.conn.execute('SELECT etag, last_modified FROM pages WHERE url = ?', (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    # レスポンスから記録用の情報（ETag・Last-Modified・内容ハッシュ）を取り出す関数
+    # 304の時は本文がないため内容ハッシュはNoneにする
+    @staticmethod
+    def page_metadata(response):
+        content_hash = None if response.status_code == 304 else hashlib.sha1(response.content).hexdigest()
+        return response.headers.get('ETag'), response.headers.get('Last-Modified'), content_hash
+
+    # ページが前回から変わっていないか判定する関数（304または内容ハッシュが同じ）
+    def is_page_unchanged(self, url, metadata):
+        if metadata[2] is None:
+            return True
+        row = self.conn.execute('SELECT content_hash FROM pages WHERE url = ?', (url,)).fetchone()
+        return row is not None and row[0] == metadata[2]
+
+    # ページの取得状態を記録する関数（304の時は前回の内容ハッシュを残す）
+    def record_page(self, url, metadata, fetched_at):
+        etag, last_modified, content_hash = metadata
+        self.conn.execute("""
+            INSERT INTO pages(url, etag, last_modified, content_hash, fetched_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                etag = COALESCE(excluded.etag, etag),
+                last_modified = COALESCE(excluded.last_modified, last_modified),
+                content_hash = COALESCE(excluded.content_hash, content_hash),
+                fetched_at = excluded.fetched_at
+        """, (url, etag, last_modified, content_hash, fetched_at))
+        self.conn.commit()
+
+    # 変更のないページに載っている物件のlast_seenを更新する関数
+    def touch_page_listings(self, url, seen_at):
+        self.conn.execute(
+            f'UPDATE {self.table_name} SET last_seen = ? WHERE "掲載ページ" = ? AND "掲載終了" IS NULL',
+            (seen_at, url)
+        )
+        self.conn.commit()
+
+    # 物件を追加・更新する関数（新規・変更・変更なしの件数を返す）
+    def upsert_listings(self, listings, seen_at, commit=True):
+        rows = []
+        for listing in listings:
+            values = [listing.get(col) for col in LISTING_COLUMNS]
+            # first_seen・last_seen・掲載終了は移行時だけ引き継ぐ
+            history = [
+                make_listing_key(listing), listing.get('掲載ページ'), make_content_hash(listing),
+                listing.get('first_seen') or seen_at, listing.get('last_seen') or seen_at, seen_at, listing.get('掲載終了')
+            ]
+            rows.append(values + history + [listing.get(col) for col in GEO_COLUMNS])
+        existing = {}
+        keys = [row[len(LISTING_COLUMNS)] for row in rows]
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            existing.update(self.conn.execute(
+                f'SELECT "物件キー", "内容ハッシュ" FROM {self.table_name} WHERE "物件キー" IN ({placeholders})', chunk
+            ).fetchall())
+
+        insert_columns = LISTING_COLUMNS + HISTORY_COLUMNS + GEO_COLUMNS
+        column_list = ', '.join(f'"{col}"' for col in insert_columns)
+        placeholders = ', '.join('?' for _ in insert_columns)
+        updates = ', '.join(f'"{col}" = excluded."{col}"' for col in LISTING_COLUMNS)
+        # 今回座標が得られなかった場合は前回の座標を残す
+        updates += ''.join(f', "{col}" = COALESCE(excluded."{col}", "{col}")' for col in GEO_COLUMNS)
+        self.conn.executemany(f"""
+            INSERT INTO {self.table_name}({column_list}) VALUES ({placeholders})
+            ON CONFLICT("物件キー") DO UPDATE SET
+                {updates},
+                "掲載ページ" = excluded."掲載ページ",
+                updated_at = CASE WHEN "内容ハッシュ" = excluded."内容ハッシュ" THEN updated_at ELSE excluded.updated_at END,
+                "内容ハッシュ" = excluded."内容ハッシュ",
+                last_seen = excluded.last_seen,
+                "掲載終了" = NULL
+        """, rows)
+        if rows:
+            # アプリの共有ストアに読み込み直させる
+            bump_data_version(self.conn)
+        if commit:
+            self.conn.commit()
+
+        stats = {'new': 0, 'changed': 0, 'unchanged': 0}
+        for row in rows:
+            key, content_hash = row[len(LISTING_COLUMNS)], row[len(LISTING_COLUMNS) + 2]
+            if key not in existing:
+                stats['new'] += 1
+            elif existing[key] != content_hash:
+                stats['changed'] += 1
+            else:
+                stats['unchanged'] += 1
+        return stats
+
+    # 今回の実行で見つからなかった物件を掲載終了にする関数（全ページを取得できた時だけ呼ぶ）
+    # 対象は今回取得した範囲の物件だけ：掲載ページがpage_prefixes（サイト・区ごとの一覧ページのURLの先頭）のどれかで始まる物件と、
+    # 掲載ページのない物件（旧テーブルから移行した物件）のうち区がwardsに含まれる物件
+    def mark_delisted(self, run_started, page_prefixes, wards=()):
+        conditions = ['substr("掲載ページ", 1, ?) = ?' for _ in page_prefixes]
+        params = [value for prefix in page_prefixes for value in (len(prefix), prefix)]
+        if wards:
+            conditions.append(f'("掲載ページ" IS NULL AND "区" IN ({", ".join("?" for _ in wards)}))')
+            params.extend(wards)
+        if not conditions:
+            return 0
+        cursor = self.conn.execute(
+            f'UPDATE {self.table_name} SET "掲載終了" = ? WHERE last_seen < ? AND "掲載終了" IS NULL AND ({" OR ".join(conditions)})',
+            [run_started, run_started] + params
+        )
+        if cursor.rowcount:
+            bump_data_version(self.conn)
+        self.conn.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,42 @@
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+
+# 東京23区（区名 -> URLに使うローマ字）
+WARDS = {
+    '千代田区': 'chiyoda', '中央区': 'chuo', '港区': 'minato', '新宿区': 'shinjuku', '文京区': 'bunkyo',
+    '台東区': 'taito', '墨田区': 'sumida', '江東区': 'koto', '品川区': 'shinagawa', '目黒区': 'meguro',
+    '大田区': 'ota', '世田谷区': 'setagaya', '渋谷区': 'shibuya', '中野区': 'nakano', '杉並区': 'suginami',
+    '豊島区': 'toshima', '北区': 'kita', '荒川区': 'arakawa', '板橋区': 'itabashi', '練馬区': 'nerima',
+    '足立区': 'adachi', '葛飾区': 'katsushika', '江戸川区': 'edogawa',
+}
+
+# サイトごとの一覧ページのURL（slugは区のローマ字、pageは1から）
+SITES = {
+    'homes': 'https://www.homes.co.jp/chintai/tokyo/{slug}-city/list/?page={page}',
+    'suumo': 'https://suumo.jp/chintai/tokyo/sc_{slug}/?page={page}',
+}
+
+PAGE_PATTERN = re.compile(r'[?&]page=(\d+)')
+
+def page_url(site, slug, page):
+    return SITES[site].format(slug=slug, page=page)
+
+# 区・サイトの一覧ページに共通するURLの先頭部分（ページ番号の前まで）
+def page_url_prefix(site, slug):
+    return SITES[site].split('{page}')[0].format(slug=slug)
+
+# 一覧ページのページ送りのリンクから最終ページの番号を求める関数（リンクがなければ1ページ）
+def count_pages(html):
+    soup = BeautifulSoup(html, 'lxml', parse_only=SoupStrainer('a', href=PAGE_PATTERN))
+    pages = [int(match.group(1)) for a in soup.find_all('a') for match in [PAGE_PATTERN.search(a['href'])] if match]
+    return max(pages, default=1)
+
+# 環境変数の「,」区切りの指定から対象を選ぶ関数（指定がなければ全部）
+def select(names, registry):
+    if not names:
+        return list(registry)
+    selected = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in registry]
+    if unknown:
+        raise ValueError(f"Unknown names: {', '.join(unknown)}")
+    return selected
@@ -0,0 +1,22 @@
+from collections import deque
+from itertools import islice
+
+# Executor.mapと同じく入力順に結果を返すが、実行中のタスクをwindow件までに抑えるジェネレータ
+# （Executor.mapは入力を最初に全部読み込むため、大量のページを流すとメモリを使い切る）
+def bounded_map(executor, fn, iterable, window):
+    pending = deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# iterableをsize件ずつのリストに分けるジェネレータ
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch